@@ -1,36 +1,56 @@
-import io
-import random
-
-import boto3
-import matplotlib.pyplot as plt
-import streamlit as st
+import asyncio
+import contextlib
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import agent_logging
+import artifacts
+import aws_clients
+import trace_parser
+import turn_timing
+from event_replay import ReplayEventStream, StubAgentClient
+from session_ids import new_session_id
+from trace_parser import FileOutput, TextDelta, TraceRecord
+
+# Optional, used by the async API when installed
+try:
+    import aioboto3
+except ImportError:
+    aioboto3 = None
 
 AGENT_ID = "REPLACE_WITH_YOUR_AGENT_ID"
 REGION = "us-west-2"
 IMAGE_FOLDER = "images"
+# Set to a recorded completion stream (see event_replay.py) to run without Bedrock
+REPLAY_FILE = os.getenv("AGENT_REPLAY_FILE")
 
-bedrock_runtime = boto3.client(
-    service_name="bedrock-runtime",
-    region_name=REGION,
-)
+# Upper bound on agent turns running at once through the async API
+MAX_CONCURRENT_TURNS = int(os.getenv("MAX_CONCURRENT_TURNS", "32"))
 
-bedrock_agent_runtime = boto3.client(
-    service_name="bedrock-agent-runtime", region_name=REGION
-)
+logger = agent_logging.get_logger(__name__)
 
+# Shared clients, see aws_clients.py
+bedrock_runtime = aws_clients.get_client("bedrock-runtime", REGION)
+bedrock_agent_runtime = aws_clients.get_client("bedrock-agent-runtime", REGION)
 
-def generate_random_15digit():
-    number = ""
+# Keep agent generated images in memory instead of writing them to IMAGE_FOLDER
+IMAGES_IN_MEMORY = os.getenv("IMAGES_IN_MEMORY", "").lower() == "true"
 
-    for _ in range(15):
-        number += str(random.randint(0, 9))
+# Shared by every session in this process, so identical images are stored once
+artifact_store = artifacts.ArtifactStore(
+    None if IMAGES_IN_MEMORY else IMAGE_FOLDER,
+    memory_bytes=int(os.getenv("ARTIFACT_MEMORY_BYTES", str(64 * 2**20))),
+    disk_bytes=int(os.getenv("ARTIFACT_DISK_BYTES", str(1024 * 2**20))),
+)
 
-    return number
+_turn_slots_by_loop = weakref.WeakKeyDictionary()
+_async_clients = weakref.WeakKeyDictionary()
 
 
-def invoke_bedrock_agent(inputText, sessionId, trace_container, endSession=False):
-    # Invoke the Bedrock agent with the given input text
-    response = bedrock_agent_runtime.invoke_agent(
+def _invoke_agent_kwargs(inputText, sessionId, endSession):
+    return dict(
         agentAliasId="TSTALIASID",
         agentId=AGENT_ID,
         sessionId=sessionId,
@@ -39,232 +59,234 @@ def invoke_bedrock_agent(inputText, sessionId, trace_container, endSession=False
         enableTrace=True,
     )
 
-    # Get the event stream from the response
-    event_stream = response["completion"]
 
+def stream_bedrock_agent(inputText, sessionId, endSession=False):
+    """Invoke the Bedrock agent and yield parsed records as they arrive."""
+    if REPLAY_FILE:
+        event_stream = ReplayEventStream.from_jsonl(REPLAY_FILE)
+    else:
+        response = bedrock_agent_runtime.invoke_agent(
+            **_invoke_agent_kwargs(inputText, sessionId, endSession)
+        )
+        event_stream = response["completion"]
+
+    yield from trace_parser.parse_agent_events(event_stream)
+
+
+def save_file(file, model_response):
+    """Save a file emitted by the agent and record it in the model response."""
+    # Stored as the original bytes under a content-addressed name, never under
+    # the name the agent gave it, so identical outputs share one stored copy
+    name = artifact_store.put(file.data, file.type)
+    if file.type == "image/png":
+        model_response["images"].append(name)
+        logger.info("Image '%s' saved as %s.", file.name, name)
+    else:
+        model_response["files"].append(name)
+        logger.info("File '%s' saved as %s.", file.name, name)
+
+
+def collect_record(record, model_response):
+    """Add a parsed record to the model response, saving any file it carries."""
+    if isinstance(record, TextDelta):
+        model_response["text"] += record.text
+    elif isinstance(record, TraceRecord):
+        model_response["traces"].append(record.to_dict())
+    elif isinstance(record, FileOutput):
+        save_file(record, model_response)
+
+
+def run_agent(inputText, sessionId, sinks=(), endSession=False):
+    """
+    Run one agent turn without any UI and return the model response. Every parsed
+    record is also passed to each sink's handle(), and sinks are closed at the end.
+    The latency breakdown of the turn is returned under "timing" (a TurnTimer).
+    """
     model_response = {"text": "", "images": [], "files": [], "traces": []}
+    timer = turn_timing.TurnTimer(sessionId)
 
-    # Process each event in the stream
-    for index, event in enumerate(event_stream):
-        print(f"Event {index}:")
-        print(str(event))
-        print("\n")
-
+    with agent_logging.session_context(sessionId):
         try:
-            # Check trace
-            if "trace" in event:
-                if (
-                    "trace" in event["trace"]
-                    and "orchestrationTrace" in event["trace"]["trace"]
-                ):
-                    trace_event = event["trace"]["trace"]["orchestrationTrace"]
-                    if "rationale" in trace_event:
-                        trace_text = trace_event["rationale"]["text"]
-                        trace_object = {"trace_type": "rationale", "text": trace_text}
-                        model_response["traces"].append(trace_object)
-
-                        with trace_container.expander("rationale"):
-                            st.markdown(trace_text)
-
-                    # for invocationInput type
-                    if "invocationInput" in trace_event:
-                        if (
-                            "codeInterpreterInvocationInput"
-                            in trace_event["invocationInput"]
-                        ):
-                            trace_code = trace_event["invocationInput"][
-                                "codeInterpreterInvocationInput"
-                            ]["code"]
-                            trace_object = {
-                                "trace_type": "codeInterpreter",
-                                "text": trace_code,
-                            }
-                            model_response["traces"].append(trace_object)
-
-                            with trace_container.expander("codeInterpreter"):
-                                st.code(trace_code)
-                        if "knowledgeBaseLookupInput" in trace_event["invocationInput"]:
-                            trace_text = trace_event["invocationInput"][
-                                "knowledgeBaseLookupInput"
-                            ]["text"]
-                            trace_object = {
-                                "trace_type": "knowledgeBaseLookup",
-                                "text": trace_text,
-                            }
-                            model_response["traces"].append(trace_object)
-
-                            with trace_container.expander("knowledgeBaseLookup"):
-                                st.markdown(trace_text)
-
-                        if (
-                            "actionGroupInvocationInput"
-                            in trace_event["invocationInput"]
-                        ):
-                            trace_text = trace_event["invocationInput"][
-                                "actionGroupInvocationInput"
-                            ]["function"]
-                            trace_object = {
-                                "trace_type": "actionGroupInvocation",
-                                "text": trace_text,
-                            }
-                            model_response["traces"].append(trace_object)
-
-                            with trace_container.expander("actionGroupInvocation"):
-                                st.markdown(f"Calling function: {trace_text}")
-
-                    # for observation type
-                    if "observation" in trace_event:
-                        if (
-                            "codeInterpreterInvocationOutput"
-                            in trace_event["observation"]
-                        ):
-                            if (
-                                "executionOutput"
-                                in trace_event["observation"][
-                                    "codeInterpreterInvocationOutput"
-                                ]
-                            ):
-                                trace_resp = trace_event["observation"][
-                                    "codeInterpreterInvocationOutput"
-                                ]["executionOutput"]
-                                trace_object = {
-                                    "trace_type": "observation",
-                                    "text": trace_resp,
-                                }
-                                model_response["traces"].append(trace_object)
-
-                                with trace_container.expander("observation"):
-                                    st.markdown(trace_resp)
-                            if (
-                                "executionError"
-                                in trace_event["observation"][
-                                    "codeInterpreterInvocationOutput"
-                                ]
-                            ):
-                                trace_resp = trace_event["observation"][
-                                    "codeInterpreterInvocationOutput"
-                                ]["executionError"]
-                                trace_object = {
-                                    "trace_type": "observation",
-                                    "text": trace_resp,
-                                }
-                                model_response["traces"].append(trace_object)
-
-                                with trace_container.expander("observation"):
-                                    st.error(trace_resp)
-
-                        if "knowledgeBaseLookupOutput" in trace_event["observation"]:
-                            # trace_text = trace_event["observation"][
-                            #     "knowledgeBaseLookupOutput"
-                            # ]["text"]
-                            trace_object = {
-                                "trace_type": "knowledgeBaseLookupOutput",
-                                "text": trace_event["observation"][
-                                    "knowledgeBaseLookupOutput"
-                                ]["retrievedReferences"],
-                            }
-                            model_response["traces"].append(trace_object)
-
-                            with trace_container.expander("knowledgeBaseLookupOutput"):
-                                # st.markdown(trace_text)
-
-                                if (
-                                    "retrievedReferences"
-                                    in trace_event["observation"][
-                                        "knowledgeBaseLookupOutput"
-                                    ]
-                                ):
-                                    references = trace_event["observation"][
-                                        "knowledgeBaseLookupOutput"
-                                    ]["retrievedReferences"]
-                                    for reference in references:
-                                        st.markdown(
-                                            f'{reference["location"]["s3Location"]["uri"]}'
-                                        )
-                                        st.markdown(f'{reference["content"]["text"]}')
-
-                        if "actionGroupInvocationOutput" in trace_event["observation"]:
-                            trace_resp = trace_event["observation"][
-                                "actionGroupInvocationOutput"
-                            ]["text"]
-                            trace_object = {
-                                "trace_type": "observation",
-                                "text": trace_resp,
-                            }
-                            model_response["traces"].append(trace_object)
-
-                            with trace_container.expander("observation"):
-                                st.markdown(trace_resp)
-
-                        if "finalResponse" in trace_event["observation"]:
-                            trace_resp = trace_event["observation"]["finalResponse"][
-                                "text"
-                            ]
-                            trace_object = {
-                                "trace_type": "finalResponse",
-                                "text": trace_resp,
-                            }
-                            model_response["traces"].append(trace_object)
-
-                            with trace_container.expander("finalResponse"):
-                                st.markdown(trace_resp)
-
-                elif "guardrailTrace" in event["trace"]["trace"]:
-
-                    guardrail_trace = event["trace"]["trace"]["guardrailTrace"]
-                    if "inputAssessments" in guardrail_trace:
-                        assessments = guardrail_trace["inputAssessments"]
-                        for assessment in assessments:
-                            if "contentPolicy" in assessment:
-                                filters = assessment["contentPolicy"]["filters"]
-                                for filter in filters:
-                                    if filter["action"] == "BLOCKED":
-                                        st.error(
-                                            f"Guardrail blocked {filter['type']} confidence: {filter['confidence']}"
-                                        )
-                            if "topicPolicy" in assessment:
-                                topics = assessment["topicPolicy"]["topics"]
-                                for topic in topics:
-                                    if topic["action"] == "BLOCKED":
-                                        st.error(
-                                            f"Guardrail blocked topic {topic['name']}"
-                                        )
-            # Handle text chunks
-            if "chunk" in event:
-                chunk = event["chunk"]
-                if "bytes" in chunk:
-                    text = chunk["bytes"].decode("utf-8")
-                    print(f"Chunk: {text}")
-                    model_response["text"] += text
-                    return model_response
-
-            # Handle file outputs
-            if "files" in event:
-                print("Files received")
-                files = event["files"]["files"]
-                for file in files:
-                    name = file["name"]
-                    type = file["type"]
-                    bytes_data = file["bytes"]
-
-                    # Display PNG images using matplotlib
-                    if type == "image/png":
-
-                        # save image to disk
-                        img = plt.imread(io.BytesIO(bytes_data))
-                        img_name = f"{IMAGE_FOLDER}/{name}"
-                        plt.imsave(img_name, img)
-
-                        # if image name not in images
-                        if img_name not in model_response["images"]:
-                            model_response["images"].append(img_name)
-                        print(f"Image '{name}' saved to disk.")
-                    # Save other file types to disk
-                    else:
-                        with open(name, "wb") as f:
-                            f.write(bytes_data)
-                            model_response["files"].append(name)
-                        print(f"File '{name}' saved to disk.")
+            for record in stream_bedrock_agent(inputText, sessionId, endSession):
+                try:
+                    timer.observe(record)
+                    with timer.measure("collect"):
+                        collect_record(record, model_response)
+                    with timer.measure("render"):
+                        for sink in sinks:
+                            sink.handle(record)
+                except Exception as e:
+                    logger.warning("Error processing event: %s", e)
+                    continue
+        finally:
+            with timer.measure("render"):
+                for sink in sinks:
+                    sink.close()
+
+    model_response["images"] = list(dict.fromkeys(model_response["images"]))
+    model_response["timing"] = _finish_timing(timer)
+    return model_response
+
+
+def _finish_timing(timer):
+    timer.finish()
+    logger.debug("Turn timing: %s", agent_logging.Truncated(timer.to_dict()))
+    turn_timing.export_to_opentelemetry(timer)
+    return timer
+
+
+def invoke_bedrock_agent(
+    inputText, sessionId, trace_container, endSession=False, text_placeholder=None
+):
+    """
+    Invoke the Bedrock agent and render the turn in Streamlit as it streams in. If a
+    text_placeholder is given, the answer is written to it progressively.
+    """
+    # Imported here so the rest of this module can run without Streamlit
+    from st_sink import StreamlitSink
+
+    sink = StreamlitSink(trace_container, text_placeholder)
+    return run_agent(inputText, sessionId, [sink], endSession)
+
+
+def run_agent_batch(prompts, max_workers=4):
+    """Run prompts headless in a thread pool, each in a new session, e.g. for evaluation."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(run_agent, prompt, new_session_id()) for prompt in prompts
+        ]
+        return [future.result() for future in futures]
+
+
+def _turn_slots():
+    # Semaphores belong to one event loop, so keep one per running loop
+    loop = asyncio.get_running_loop()
+    if loop not in _turn_slots_by_loop:
+        _turn_slots_by_loop[loop] = asyncio.Semaphore(MAX_CONCURRENT_TURNS)
+    return _turn_slots_by_loop[loop]
+
+
+async def _async_agent_client():
+    """One aioboto3 bedrock-agent-runtime client per event loop, shared by all turns."""
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        stack = contextlib.AsyncExitStack()
+        client = await stack.enter_async_context(
+            aioboto3.Session().client("bedrock-agent-runtime", region_name=REGION)
+        )
+        _async_clients[loop] = (stack, client)
+    return _async_clients[loop][1]
+
+
+async def aclose_async_clients():
+    """Close the aioboto3 client of the running event loop, e.g. on shutdown."""
+    entry = _async_clients.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+        await entry[0].aclose()
+
+
+async def _threaded_event_stream(inputText, sessionId, endSession):
+    """
+    Fallback when aioboto3 is not installed: read the boto3 event stream in a
+    worker thread and hand the events to the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def pump():
+        try:
+            response = bedrock_agent_runtime.invoke_agent(
+                **_invoke_agent_kwargs(inputText, sessionId, endSession)
+            )
+            event_stream = response["completion"]
+            try:
+                for event in event_stream:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, event)
+            finally:
+                event_stream.close()
         except Exception as e:
-            print(f"Error processing event: {e}")
-            continue
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    loop.run_in_executor(None, pump)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # The worker stops at its next event; there is no need to wait for it
+        stop.set()
+
+
+async def aiter_bedrock_agent(inputText, sessionId, endSession=False, client=None):
+    """
+    Async counterpart of stream_bedrock_agent. client can be any object with an
+    async invoke_agent, e.g. event_replay.StubAgentClient; by default a shared
+    aioboto3 client is used, or a worker thread if aioboto3 is not installed.
+    """
+    if client is None and REPLAY_FILE:
+        client = StubAgentClient(ReplayEventStream.from_jsonl(REPLAY_FILE))
+    if client is None and aioboto3 is not None:
+        client = await _async_agent_client()
+
+    if client is not None:
+        response = await client.invoke_agent(
+            **_invoke_agent_kwargs(inputText, sessionId, endSession)
+        )
+        event_stream = response["completion"]
+    else:
+        event_stream = _threaded_event_stream(inputText, sessionId, endSession)
+
+    async for record in trace_parser.aparse_agent_events(event_stream):
+        yield record
+
+
+async def ainvoke_bedrock_agent(
+    inputText, sessionId, sinks=(), endSession=False, client=None
+):
+    """
+    Async counterpart of run_agent, so one process can serve many chat sessions.
+    At most MAX_CONCURRENT_TURNS turns run at once; further turns wait for a slot.
+    """
+    model_response = {"text": "", "images": [], "files": [], "traces": []}
+
+    async with _turn_slots():
+        # Timed from when the turn gets a slot, so queueing is not counted
+        timer = turn_timing.TurnTimer(sessionId)
+        with agent_logging.session_context(sessionId):
+            try:
+                async for record in aiter_bedrock_agent(
+                    inputText, sessionId, endSession, client
+                ):
+                    try:
+                        timer.observe(record)
+                        with timer.measure("collect"):
+                            if isinstance(record, FileOutput):
+                                # Saving files is blocking disk work
+                                await asyncio.to_thread(
+                                    collect_record, record, model_response
+                                )
+                            else:
+                                collect_record(record, model_response)
+                        with timer.measure("render"):
+                            for sink in sinks:
+                                sink.handle(record)
+                    except Exception as e:
+                        logger.warning("Error processing event: %s", e)
+                        continue
+            finally:
+                for sink in sinks:
+                    sink.close()
+
+    model_response["images"] = list(dict.fromkeys(model_response["images"]))
+    model_response["timing"] = _finish_timing(timer)
+    return model_response
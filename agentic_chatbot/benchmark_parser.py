@@ -0,0 +1,260 @@
+"""
+Offline benchmark of the client-side cost of an agent turn: completion event
+streams are replayed through trace_parser, with no Bedrock latency involved.
+
+    python benchmark_parser.py                      # all synthetic scenarios
+    python benchmark_parser.py --replay turn.jsonl  # a recorded stream (save_events)
+    python benchmark_parser.py --save base.json     # store results as a baseline
+    python benchmark_parser.py --baseline base.json # fail if events/sec regressed
+
+Copies of this module are kept identical by sync_shared_modules.py at the
+repository root: edit the first copy it lists, then run it.
+"""
+
+import argparse
+import codecs
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+import trace_parser
+from event_replay import ReplayEventStream
+
+# 1x1 PNG, padded to reach the requested file sizes
+PNG_BYTES = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010802000000907753de"
+    "0000000c4944415478da63f8cfc000000301010000c9fe92ef0000000049454e44ae426082"
+)
+
+
+def _trace(inner):
+    return {
+        "trace": {
+            "agentId": "AGENT",
+            "sessionId": "benchmark",
+            "eventTime": "2024-12-01T10:00:00Z",
+            "trace": {"orchestrationTrace": inner},
+        }
+    }
+
+
+def synthetic_events(
+    steps=5, references=0, reference_bytes=1000, files=0, file_bytes=10_000, chunks=20
+):
+    """
+    Build a completion stream: steps orchestration steps (rationale, code
+    interpreter input and output), a knowledge base lookup with references of
+    reference_bytes each, the answer in chunks, and files of file_bytes each.
+    """
+    events = []
+    for step in range(steps):
+        events.append(_trace({"rationale": {"text": f"Step {step}: plot the data."}}))
+        events.append(
+            _trace(
+                {
+                    "invocationInput": {
+                        "invocationType": "ACTION_GROUP_CODE_INTERPRETER",
+                        "codeInterpreterInvocationInput": {
+                            "code": "import pandas as pd\n" * 20
+                        },
+                    }
+                }
+            )
+        )
+        events.append(
+            _trace(
+                {
+                    "observation": {
+                        "type": "ACTION_GROUP_CODE_INTERPRETER",
+                        "codeInterpreterInvocationOutput": {
+                            "executionOutput": "ok\n" * 50
+                        },
+                    }
+                }
+            )
+        )
+
+    if references:
+        events.append(
+            _trace(
+                {
+                    "observation": {
+                        "type": "KNOWLEDGE_BASE",
+                        "knowledgeBaseLookupOutput": {
+                            "retrievedReferences": [
+                                {
+                                    "content": {"text": "x" * reference_bytes},
+                                    "location": {
+                                        "s3Location": {"uri": f"s3://docs/{i}.pdf"}
+                                    },
+                                }
+                                for i in range(references)
+                            ]
+                        },
+                    }
+                }
+            )
+        )
+
+    answer = "Here is the answer, with a non-ASCII character: é. " * chunks
+    events.append(
+        _trace({"observation": {"type": "FINISH", "finalResponse": {"text": answer}}})
+    )
+    # Split the encoded answer at arbitrary byte offsets, as the service may
+    data = answer.encode("utf-8")
+    size = max(len(data) // max(chunks, 1), 1)
+    for start in range(0, len(data), size):
+        events.append({"chunk": {"bytes": data[start : start + size]}})
+
+    if files:
+        padding = b"\0" * max(file_bytes - len(PNG_BYTES), 0)
+        events.append(
+            {
+                "files": {
+                    "files": [
+                        {
+                            "name": f"chart{i}.png",
+                            "type": "image/png",
+                            "bytes": PNG_BYTES + padding,
+                        }
+                        for i in range(files)
+                    ]
+                }
+            }
+        )
+    return events
+
+
+SCENARIOS = {
+    "small": dict(steps=1, chunks=5),
+    "many_traces": dict(steps=200, chunks=50),
+    "large_kb_references": dict(steps=2, references=100, reference_bytes=20_000),
+    "multi_file": dict(steps=3, files=10, file_bytes=500_000),
+}
+
+
+def _percentile(sorted_values, fraction):
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def run_scenario(events, repeat=20):
+    """Replay events repeat times and return the timing and allocation stats."""
+    per_event_ns = []
+    total_ns = 0
+    for _ in range(repeat):
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        for index, event in enumerate(events):
+            start = time.perf_counter_ns()
+            for _ in trace_parser.parse_event(event, index, decoder):
+                pass
+            elapsed = time.perf_counter_ns() - start
+            per_event_ns.append(elapsed)
+            total_ns += elapsed
+
+    # The end-to-end path, through the stream wrapper and decoder flush
+    start = time.perf_counter_ns()
+    for _ in range(repeat):
+        for _ in trace_parser.parse_agent_events(ReplayEventStream(events)):
+            pass
+    stream_ns = time.perf_counter_ns() - start
+
+    # Allocations are measured in a separate pass, tracemalloc slows everything down
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    records = list(trace_parser.parse_agent_events(ReplayEventStream(events)))
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    allocated = sum(
+        stat.size_diff
+        for stat in after.compare_to(before, "filename")
+        if stat.size_diff > 0
+    )
+    del records
+
+    per_event_ns.sort()
+    return {
+        "events": len(events),
+        "events_per_sec": len(events) * repeat / (stream_ns / 1e9),
+        "p50_us": _percentile(per_event_ns, 0.50) / 1000,
+        "p99_us": _percentile(per_event_ns, 0.99) / 1000,
+        "mean_us": total_ns / len(per_event_ns) / 1000,
+        "allocated_kib": allocated / 1024,
+        "traced_peak_kib": peak / 1024,
+    }
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--replay", help="recorded stream (JSON lines) to replay")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved earlier")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="allowed drop in events/sec relative to the baseline (default 0.2)",
+    )
+    args = parser.parse_args()
+
+    if args.replay:
+        streams = {
+            os.path.basename(args.replay): list(
+                ReplayEventStream.from_jsonl(args.replay)
+            )
+        }
+    else:
+        names = args.scenario or list(SCENARIOS)
+        streams = {name: synthetic_events(**SCENARIOS[name]) for name in names}
+
+    results = {}
+    print(
+        f"{'scenario':<22}{'events':>8}{'events/s':>12}{'p50 us':>10}"
+        f"{'p99 us':>10}{'alloc KiB':>12}{'peak KiB':>11}"
+    )
+    for name, events in streams.items():
+        result = results[name] = run_scenario(events, args.repeat)
+        print(
+            f"{name:<22}{result['events']:>8}{result['events_per_sec']:>12.0f}"
+            f"{result['p50_us']:>10.1f}{result['p99_us']:>10.1f}"
+            f"{result['allocated_kib']:>12.1f}{result['traced_peak_kib']:>11.1f}"
+        )
+    print(f"peak RSS: {peak_rss_mib():.1f} MiB")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = [
+            name
+            for name, result in results.items()
+            if name in baseline
+            and result["events_per_sec"]
+            < baseline[name]["events_per_sec"] * (1 - args.max_regression)
+        ]
+        for name in regressions:
+            print(
+                f"REGRESSION {name}: {results[name]['events_per_sec']:.0f} events/s, "
+                f"baseline {baseline[name]['events_per_sec']:.0f}"
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
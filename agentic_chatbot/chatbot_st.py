@@ -1,6 +1,61 @@
+import os
+
 import agent_tools
+import history_view
+import session_ids
+import session_persistence
+import session_store
+import st_sink
 import streamlit as st
-from PIL import Image
+
+# Width of images in older messages
+THUMBNAIL_WIDTH = 320
+
+# Per-session memory budget for the chat history, and where evicted messages go
+SESSION_BYTE_BUDGET = int(os.getenv("SESSION_BYTE_BUDGET", str(2 * 2**20)))
+SESSION_SPILL_DIR = os.getenv("SESSION_SPILL_DIR")
+
+
+def display_image(image_name, thumbnail=False):
+    """Display an agent generated image, served from the artifact store"""
+    image_data = agent_tools.artifact_store.get(image_name)
+    if image_data is None:
+        st.caption("Image no longer available")
+    else:
+        st.image(image_data, width=THUMBNAIL_WIDTH if thumbnail else None)
+
+
+def new_session(resume_id=None):
+    """
+    Start a new conversation with an empty, bounded message store, or resume a
+    persisted one. The session id is kept in the URL so a reload, or another
+    replica, can pick the conversation up again.
+    """
+    if resume_id is not None and not session_ids.is_valid_session_id(resume_id):
+        # The id comes from the URL; anything else starts a new session
+        resume_id = None
+    writer = session_persistence.get_writer()
+    exists = writer.backend.session_exists if writer is not None else None
+    session_id = resume_id or session_ids.new_session_id(exists)
+    spill_path = None
+    if SESSION_SPILL_DIR:
+        spill_path = os.path.join(SESSION_SPILL_DIR, f"{session_id}.jsonl")
+
+    st.session_state.session_id = session_id
+    st.session_state.store = session_store.SessionStore(
+        byte_budget=SESSION_BYTE_BUDGET,
+        spill_path=spill_path,
+        artifact_store=agent_tools.artifact_store,
+        session_id=session_id,
+        writer=writer,
+    )
+    if resume_id and writer is not None:
+        # Writes still queued in this process must land before reading back
+        writer.flush()
+        st.session_state.store.restore(writer.backend.load_messages(resume_id))
+    st.session_state.history_cache = {}
+    st.query_params["session"] = session_id
+
 
 st.title("Amazon Bedrock Agentic Chatbot")  # Title of the application
 
@@ -9,57 +64,53 @@ st.sidebar.markdown(
     "This app shows an Agentic Chatbot powered by Amazon Bedrock to answer questions."
 )
 clear_button = st.sidebar.button("Clear Conversation", key="clear")
+timing_placeholder = st.sidebar.empty()
 # reset sessions state on clear
 if clear_button:
-    st.session_state.messages = []
-    st.session_state.session_id = agent_tools.generate_random_15digit()
-
+    new_session()
+elif "store" not in st.session_state:
+    new_session(st.query_params.get("session"))
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-    st.session_state.session_id = agent_tools.generate_random_15digit()
-
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-
-        if "traces" in message:
-            trace_container = st.container()
-            for trace in message["traces"]:
-                # Show an expander for each trace type
-                with trace_container.expander(trace["trace_type"]):
-                    # If trace_type is codeInterpreter use st.code, else use st.markdown
-                    if trace["trace_type"] == "codeInterpreter":
-                        st.code(trace["text"], language="python")
-                    else:
-                        st.markdown(trace["text"])
-
-        st.markdown(message["content"][0]["text"])
-        # TODO show images
+history_view.render_history(
+    st.session_state.store.messages(),
+    st.session_state.session_id,
+    display_image,
+    start_index=st.session_state.store.evicted,
+)
 
 if prompt := st.chat_input("How can I help??"):
-    st.session_state.messages.append({"role": "user", "content": [{"text": prompt}]})
+    st.session_state.store.append({"role": "user", "content": [{"text": prompt}]})
     with st.chat_message("user"):
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        message_placeholder = st.empty()
-        full_response = ""
-
         trace_container = st.container()
+        message_placeholder = st.empty()
 
+        # Answer text is written to the placeholder as chunks stream in
         result = agent_tools.invoke_bedrock_agent(
-            prompt, st.session_state.session_id, trace_container
+            prompt,
+            st.session_state.session_id,
+            trace_container,
+            text_placeholder=message_placeholder,
         )
+        st.session_state.last_timing = result["timing"]
 
-        message_placeholder.markdown(result["text"])
-
-        # TODO show images
+        for image in result["images"]:
+            display_image(image)
 
-    st.session_state.messages.append(
+    st.session_state.store.append(
         {
             "role": "assistant",
-            "content": [{"text": f"{full_response}"}],
+            "content": [{"text": result["text"]}],
             "images": result["images"],
             "traces": result["traces"],
         }
     )
+
+# Latency breakdown of the last turn, filled in once the turn has run
+if "last_timing" in st.session_state:
+    st_sink.render_waterfall(
+        st.session_state.last_timing,
+        timing_placeholder.container().expander("Last turn latency"),
+    )
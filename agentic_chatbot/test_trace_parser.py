@@ -0,0 +1,37 @@
+import asyncio
+import unittest
+
+import trace_parser
+from event_replay import AsyncReplayEventStream, ReplayEventStream
+
+# A rationale trace without its text, followed by the answer
+EVENTS = [
+    {"trace": {"trace": {"orchestrationTrace": {"rationale": {}}}}},
+    {"trace": {"trace": {"orchestrationTrace": {"rationale": {"text": "ok"}}}}},
+    {"chunk": {"bytes": "The answer".encode("utf-8")}},
+]
+
+
+class MalformedTraceTest(unittest.TestCase):
+    def check(self, records):
+        traces = [r for r in records if isinstance(r, trace_parser.TraceRecord)]
+        texts = [r.text for r in records if isinstance(r, trace_parser.TextDelta)]
+        self.assertEqual(
+            [(r.trace_type, r.text) for r in traces], [("rationale", "ok")]
+        )
+        self.assertEqual("".join(texts), "The answer")
+
+    def test_skipped(self):
+        stream = ReplayEventStream(EVENTS)
+        self.check(list(trace_parser.parse_agent_events(stream)))
+        self.assertTrue(stream.closed)
+
+    def test_skipped_async(self):
+        async def collect(stream):
+            return [r async for r in trace_parser.aparse_agent_events(stream)]
+
+        self.check(asyncio.run(collect(AsyncReplayEventStream(EVENTS))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,111 +1,119 @@
 import json
 import math
 import os
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Annotated, List
 
-import boto3
+import aws_clients
+import converse_stream
 import utils as lambda_helpers
 from botocore.exceptions import ClientError
+from tool_registry import ToolRegistry
 
 # Retrieve environment variables
 LAMBDA_ROLE = os.environ["LAMBDA_ROLE"]
 S3_BUCKET = os.environ["S3_BUCKET"]
 REGION = "us-west-2"
 
+# Most model calls one conversation may make before the tool loop gives up
+MAX_STEPS = int(os.getenv("MAX_STEPS", "10"))
+
+# Most tool calls of one response that run at the same time
+MAX_TOOL_WORKERS = int(os.getenv("MAX_TOOL_WORKERS", "8"))
+
+# Stream responses with converse_stream: text shows as it is generated and
+# tools are prepared as soon as their toolUse block is complete. Needs the
+# bedrock:InvokeModelWithResponseStream permission on top of bedrock:InvokeModel.
+CONVERSE_STREAM = os.getenv("CONVERSE_STREAM", "false").lower() == "true"
+
+# The tools offered to the LLM, registered with @registry.tool below
+registry = ToolRegistry()
+
 
 def initialize_clients():
-    """Initialize and return the AWS Bedrock, Lambda, and S3 clients."""
-    session = boto3.Session()
-    bedrock = session.client(service_name="bedrock-runtime", region_name=REGION)
-    lambda_client = session.client("lambda", region_name=REGION)
-    s3 = session.client("s3", region_name=REGION)
+    """Return the shared AWS Bedrock, Lambda, and S3 clients."""
+    bedrock = aws_clients.get_client("bedrock-runtime", REGION)
+    lambda_client = aws_clients.get_client("lambda", REGION)
+    s3 = aws_clients.get_client("s3", REGION)
     return bedrock, lambda_client, s3
 
 
 def get_tool_list():
-    """Define and return the tool list for the LLM to use."""
-    return [
-        {
-            "toolSpec": {
-                "name": "cosine",
-                "description": "Calculate the cosine of x.",
-                "inputSchema": {
-                    "json": {
-                        "type": "object",
-                        "properties": {
-                            "x": {
-                                "type": "number",
-                                "description": "The number to pass to the function.",
-                            }
-                        },
-                        "required": ["x"],
-                    }
-                },
-            }
-        },
-        {
-            "toolSpec": {
-                "name": "create_lambda_function",
-                "description": "Create and deploy a Lambda function.",
-                "inputSchema": {
-                    "json": {
-                        "type": "object",
-                        "properties": {
-                            "code": {
-                                "type": "string",
-                                "description": "The Python code for the Lambda function.",
-                            },
-                            "function_name": {
-                                "type": "string",
-                                "description": "The name of the Lambda function.",
-                            },
-                            "description": {
-                                "type": "string",
-                                "description": "A description of the Lambda function.",
-                            },
-                            "has_external_python_libraries": {
-                                "type": "boolean",
-                                "description": "Whether the function uses external Python libraries.",
-                            },
-                            "external_python_libraries": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                                "description": "List of external Python libraries to include.",
-                            },
-                        },
-                        "required": [
-                            "code",
-                            "function_name",
-                            "description",
-                            "has_external_python_libraries",
-                            "external_python_libraries",
-                        ],
-                    }
-                },
-            }
-        },
-    ]
+    """Return the tool list for the LLM to use, generated once by the registry."""
+    return registry.tool_list()
 
 
-def query_llm(bedrock, messages, tools, system_prompt):
-    """Make a request to the LLM and return the response."""
-    return bedrock.converse(
-        modelId="anthropic.claude-3-5-sonnet-20241022-v2:0",
-        messages=messages,
-        inferenceConfig={"maxTokens": 2000, "temperature": 0},
-        toolConfig={"tools": tools},
-        system=[{"text": system_prompt}],
-    )
+def query_llm(
+    bedrock,
+    messages,
+    tools,
+    system_prompt,
+    stream=False,
+    on_text=None,
+    on_tool_use=None,
+):
+    """
+    Make a request to the LLM and return the response. With stream=True it is
+    streamed with converse_stream: on_text receives the text deltas and
+    on_tool_use each toolUse block as soon as it is complete, and the response
+    has the same shape as with converse.
+    """
+    request = {
+        "modelId": "anthropic.claude-3-5-sonnet-20241022-v2:0",
+        "messages": messages,
+        "inferenceConfig": {"maxTokens": 2000, "temperature": 0},
+        "toolConfig": {"tools": tools},
+        "system": [{"text": system_prompt}],
+    }
+    if not stream:
+        return bedrock.converse(**request)
+    response = bedrock.converse_stream(**request)
+    return converse_stream.collect(response["stream"], on_text, on_tool_use)
+
+
+@registry.tool(cacheable=True)
+def cosine(x: Annotated[float, "The number to pass to the function."]) -> float:
+    """Calculate the cosine of x."""
+    tool_result_value = math.cos(x)
+    print(f"Cosine result: {tool_result_value}")
+    return tool_result_value
+
+
+def package_lambda_function(
+    code, function_name, has_external_python_libraries, external_python_libraries, **_
+):
+    """Build the deployment package of create_lambda_function."""
+    if has_external_python_libraries:
+        zipfile = lambda_helpers.create_deployment_package_with_dependencies(
+            code, function_name, f"{function_name}.zip", external_python_libraries
+        )
+    else:
+        zipfile = lambda_helpers.create_deployment_package_no_dependencies(
+            code, function_name, f"{function_name}.zip"
+        )
+    return {"zipfile": zipfile}
 
 
+@registry.tool(
+    description="Create and deploy a Lambda function.",
+    context=["lambda_client", "s3", "zipfile"],
+    # Deployment packages are built in directories named after the function
+    concurrent=False,
+    prepare=package_lambda_function,
+)
 def create_lambda_function(
     lambda_client,
     s3,
-    code: str,
-    function_name: str,
-    description: str,
-    has_external_python_libraries: bool,
-    external_python_libraries: List[str],
+    code: Annotated[str, "The Python code for the Lambda function."],
+    function_name: Annotated[str, "The name of the Lambda function."],
+    description: Annotated[str, "A description of the Lambda function."],
+    has_external_python_libraries: Annotated[
+        bool, "Whether the function uses external Python libraries."
+    ],
+    external_python_libraries: Annotated[
+        List[str], "List of external Python libraries to include."
+    ],
+    zipfile=None,
 ) -> str:
     """
     Creates and deploys a Lambda Function, based on what the customer requested.
@@ -115,15 +123,14 @@ def create_lambda_function(
     runtime = "python3.12"
     handler = "lambda_function.handler"
 
-    # Create a zip file for the code
-    if has_external_python_libraries:
-        zipfile = lambda_helpers.create_deployment_package_with_dependencies(
-            code, function_name, f"{function_name}.zip", external_python_libraries
-        )
-    else:
-        zipfile = lambda_helpers.create_deployment_package_no_dependencies(
-            code, function_name, f"{function_name}.zip"
-        )
+    # Create a zip file for the code, unless it was prepared while streaming
+    if zipfile is None:
+        zipfile = package_lambda_function(
+            code,
+            function_name,
+            has_external_python_libraries,
+            external_python_libraries,
+        )["zipfile"]
 
     try:
         # Upload zip file
@@ -154,50 +161,150 @@ def create_lambda_function(
         return f"Error: {e}\n Let me try again..."
 
 
-def process_llm_response(response_message, lambda_client, s3):
-    """Process the LLM's response, handling tool usage and text output."""
-    response_content_blocks = response_message["content"]
-    follow_up_content_blocks = []
+def run_tool(tool_use_block, lambda_client, s3, preparing=None):
+    """
+    Run the tool a toolUse block asks for and return its result. preparing is
+    the future of its prepare step when that was started early.
+    """
+    print(f"Using tool {tool_use_block['name']}")
+    prepared = preparing.result() if preparing is not None else None
+    return registry.run(tool_use_block, prepared, lambda_client=lambda_client, s3=s3)
+
+
+def _tool_result(tool_use_block, lambda_client, s3, preparing=None):
+    """Run one toolUse block and wrap the outcome in a toolResult block."""
+    try:
+        result = run_tool(tool_use_block, lambda_client, s3, preparing)
+    except Exception as e:
+        # Reported to the model, which can correct its input and try again
+        print(f"Tool {tool_use_block['name']} failed: {e}")
+        return {
+            "toolResult": {
+                "toolUseId": tool_use_block["toolUseId"],
+                "content": [{"text": f"Error: {e}"}],
+                "status": "error",
+            }
+        }
+    return {
+        "toolResult": {
+            "toolUseId": tool_use_block["toolUseId"],
+            "content": [{"json": {"result": result}}],
+        }
+    }
+
+
+def run_tool_blocks(tool_use_blocks, lambda_client, s3, preparing=None):
+    """
+    Run the toolUse blocks of one response concurrently in a thread pool, so
+    they take as long as the slowest one instead of the sum. The toolResult
+    blocks come back in the order of the toolUse blocks, whatever order the
+    tools finish in. preparing maps toolUseIds to prepare steps started early.
+    """
+    preparing = preparing or {}
+    if len(tool_use_blocks) <= 1:
+        return [
+            _tool_result(block, lambda_client, s3, preparing.get(block["toolUseId"]))
+            for block in tool_use_blocks
+        ]
+
+    workers = min(len(tool_use_blocks), MAX_TOOL_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tool") as pool:
+        futures = {
+            block["toolUseId"]: pool.submit(
+                _tool_result,
+                block,
+                lambda_client,
+                s3,
+                preparing.get(block["toolUseId"]),
+            )
+            for block in tool_use_blocks
+        }
+    return [futures[block["toolUseId"]].result() for block in tool_use_blocks]
+
 
-    for content_block in response_content_blocks:
+def process_llm_response(
+    response_message, lambda_client, s3, preparing=None, print_text=True
+):
+    """
+    Process the LLM's response, handling tool usage and text output. Pass
+    print_text=False when the text was already shown while it streamed.
+    """
+    tool_use_blocks = []
+    for content_block in response_message["content"]:
         if "toolUse" in content_block:
-            tool_use_block = content_block["toolUse"]
-            tool_use_name = tool_use_block["name"]
-            print(f"Using tool {tool_use_name}")
-            if tool_use_name == "cosine":
-                tool_result_value = math.cos(tool_use_block["input"]["x"])
-                print(f"Cosine result: {tool_result_value}")
-                follow_up_content_blocks.append(
-                    {
-                        "toolResult": {
-                            "toolUseId": tool_use_block["toolUseId"],
-                            "content": [{"json": {"result": tool_result_value}}],
-                        }
-                    }
-                )
-            elif tool_use_name == "create_lambda_function":
-                result = create_lambda_function(
-                    lambda_client,
-                    s3,
-                    tool_use_block["input"]["code"],
-                    tool_use_block["input"]["function_name"],
-                    tool_use_block["input"]["description"],
-                    tool_use_block["input"]["has_external_python_libraries"],
-                    tool_use_block["input"]["external_python_libraries"],
-                )
-                print(f"Lambda function creation result: {result}")
-                follow_up_content_blocks.append(
-                    {
-                        "toolResult": {
-                            "toolUseId": tool_use_block["toolUseId"],
-                            "content": [{"json": {"result": result}}],
-                        }
-                    }
-                )
-        elif "text" in content_block:
+            tool_use_blocks.append(content_block["toolUse"])
+        elif "text" in content_block and print_text:
             print(f"LLM response: {content_block['text']}")
 
-    return follow_up_content_blocks
+    return run_tool_blocks(tool_use_blocks, lambda_client, s3, preparing)
+
+
+def run_tool_loop(
+    bedrock,
+    lambda_client,
+    s3,
+    message_list,
+    tool_list,
+    system_prompt,
+    max_steps=None,
+    stream=None,
+    on_text=None,
+):
+    """
+    Query the LLM and run the tools it asks for until it stops asking
+    (stopReason other than "tool_use") or max_steps model calls were made.
+    message_list is extended with the conversation; returns the last response.
+
+    When streaming (CONVERSE_STREAM by default), on_text receives the text as
+    it is generated, and each tool's prepare step (e.g. packaging a Lambda
+    function) starts as soon as its toolUse block is complete.
+    """
+    max_steps = max_steps or MAX_STEPS
+    stream = CONVERSE_STREAM if stream is None else stream
+    # on_text has already shown the text, so it is not printed again below
+    text_streamed = stream and on_text is not None
+    with ThreadPoolExecutor(
+        max_workers=MAX_TOOL_WORKERS, thread_name_prefix="prepare"
+    ) as prepare_pool:
+        for step in range(max_steps):
+            preparing = {}
+
+            def on_tool_use(tool_use_block):
+                preparing[tool_use_block["toolUseId"]] = prepare_pool.submit(
+                    registry.prepare, tool_use_block
+                )
+
+            response = query_llm(
+                bedrock,
+                message_list,
+                tool_list,
+                system_prompt,
+                stream=stream,
+                on_text=on_text,
+                on_tool_use=on_tool_use,
+            )
+            response_message = response["output"]["message"]
+            if text_streamed:
+                # End the line the streamed text was printed on
+                print()
+            else:
+                print(json.dumps(response_message, indent=4))
+            message_list.append(response_message)
+
+            follow_up_content_blocks = process_llm_response(
+                response_message,
+                lambda_client,
+                s3,
+                preparing,
+                print_text=not text_streamed,
+            )
+            if response.get("stopReason") != "tool_use" or not follow_up_content_blocks:
+                return response
+
+            message_list.append({"role": "user", "content": follow_up_content_blocks})
+
+    print(f"Stopped after {max_steps} steps without a final answer")
+    return response
 
 
 def main():
@@ -222,30 +329,16 @@ def main():
     # Set the system prompt
     system_prompt = "You are an AI assistant capable of creating Lambda functions and performing mathematical calculations. Use the provided tools when necessary."
 
-    # Make the initial request to the LLM
-    response = query_llm(bedrock, message_list, tool_list, system_prompt)
-    response_message = response["output"]["message"]
-    print(json.dumps(response_message, indent=4))
-    message_list.append(response_message)
-
-    # Process the LLM's response
-    follow_up_content_blocks = process_llm_response(response_message, lambda_client, s3)
-
-    # If there are follow-up content blocks, make another request to the LLM
-    if follow_up_content_blocks:
-        follow_up_message = {
-            "role": "user",
-            "content": follow_up_content_blocks,
-        }
-        message_list.append(follow_up_message)
-
-        response = query_llm(bedrock, message_list, tool_list, system_prompt)
-        response_message = response["output"]["message"]
-        print(json.dumps(response_message, indent=4))
-        message_list.append(response_message)
-
-        # Process the final response
-        process_llm_response(response_message, lambda_client, s3)
+    # Let the LLM use the tools until it gives its final answer
+    run_tool_loop(
+        bedrock,
+        lambda_client,
+        s3,
+        message_list,
+        tool_list,
+        system_prompt,
+        on_text=lambda text: print(text, end="", flush=True),
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,82 @@
+"""
+Assembles a Converse API response from the converse_stream event stream.
+
+collect() returns the same shape as bedrock.converse() (output.message,
+stopReason, usage and metrics), so code written for converse works unchanged.
+While the stream is read, text deltas are passed to on_text as they arrive, and
+each toolUse block is passed to on_tool_use as soon as the block closes, with
+its input parsed, so the caller can start preparing the tool while the model
+writes the rest of the response.
+
+Copies of this module are kept identical by sync_shared_modules.py at the
+repository root: edit the first copy it lists, then run it.
+"""
+
+import json
+
+
+def _finish(pending):
+    """Turn a block being streamed into a content block."""
+    if "toolUse" in pending:
+        text = "".join(pending["parts"])
+        try:
+            tool_input = json.loads(text) if text else {}
+        except ValueError:
+            # Only a response cut short (e.g. by maxTokens) leaves partial JSON
+            tool_input = {}
+        return {"toolUse": dict(pending["toolUse"], input=tool_input)}
+    return {"text": "".join(pending["parts"])}
+
+
+def collect(events, on_text=None, on_tool_use=None):
+    """Read a converse_stream event stream into a converse-like response."""
+    role = "assistant"
+    # contentBlockIndex -> block being streamed, then the finished block
+    pending = {}
+    content = {}
+    response = {"stopReason": None, "usage": {}, "metrics": {}}
+
+    for event in events:
+        if "messageStart" in event:
+            role = event["messageStart"].get("role", role)
+        elif "contentBlockStart" in event:
+            start = event["contentBlockStart"]["start"]
+            index = event["contentBlockStart"]["contentBlockIndex"]
+            if "toolUse" in start:
+                pending[index] = {"toolUse": start["toolUse"], "parts": []}
+        elif "contentBlockDelta" in event:
+            delta = event["contentBlockDelta"]["delta"]
+            index = event["contentBlockDelta"]["contentBlockIndex"]
+            # Text blocks have no start event, their first delta opens them
+            block = pending.setdefault(index, {"parts": []})
+            if "text" in delta:
+                block["parts"].append(delta["text"])
+                if on_text is not None:
+                    on_text(delta["text"])
+            elif "toolUse" in delta:
+                # The input JSON arrives in fragments, parsed once complete
+                block["parts"].append(delta["toolUse"].get("input", ""))
+        elif "contentBlockStop" in event:
+            index = event["contentBlockStop"]["contentBlockIndex"]
+            if index in pending:
+                content[index] = _finish(pending.pop(index))
+                if "toolUse" in content[index] and on_tool_use is not None:
+                    on_tool_use(content[index]["toolUse"])
+        elif "messageStop" in event:
+            response["stopReason"] = event["messageStop"].get("stopReason")
+        elif "metadata" in event:
+            response["usage"] = event["metadata"].get("usage", {})
+            response["metrics"] = event["metadata"].get("metrics", {})
+        else:
+            # Errors in the stream, e.g. throttlingException
+            name, details = next(iter(event.items()))
+            if name.endswith("Exception"):
+                raise RuntimeError(f"{name}: {details.get('message', details)}")
+
+    # Blocks left open when the stream ended early
+    for index, block in pending.items():
+        content[index] = _finish(block)
+    response["output"] = {
+        "message": {"role": role, "content": [content[i] for i in sorted(content)]}
+    }
+    return response
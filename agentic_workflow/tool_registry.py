@@ -0,0 +1,269 @@
+"""
+Registry of the tools offered to the model through the Converse API.
+
+    registry = ToolRegistry()
+
+    @registry.tool(description="Calculate the cosine of x.", cacheable=True)
+    def cosine(x: Annotated[float, "The number to pass to the function."]):
+        return math.cos(x)
+
+    registry.tool_list()            # toolConfig["tools"] for converse
+    registry.run(tool_use_block)    # validate the input and call the tool
+
+The toolSpec of each tool is generated once, at registration, from its
+signature: parameter types (str, int, float, bool, list, List[...], dict)
+become the JSON schema, Annotated[...] strings their descriptions and the
+docstring the tool description, unless description= is given. Parameters
+without a default are required. Parameters named in context= are not shown to
+the model; run() passes them from its keyword arguments, e.g. AWS clients.
+
+A tool can also have a prepare step, called with the validated input, whose
+result (a dict) adds keyword arguments to the tool call. prepare() lets the
+caller start it early, e.g. as soon as a streamed toolUse block is complete.
+"""
+
+import inspect
+import json
+import threading
+import typing
+
+# JSON schema types of the Python types tools can take
+JSON_TYPES = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    list: "array",
+    dict: "object",
+}
+
+
+class ToolInputError(ValueError):
+    """A tool input that does not match the tool's schema, or an unknown tool."""
+
+
+def _is_type(json_type):
+    """Precompiled check of one JSON value against a JSON schema type."""
+    if json_type == "integer":
+        return lambda value: isinstance(value, int) and not isinstance(value, bool)
+    if json_type == "number":
+        return lambda value: isinstance(value, (int, float)) and not isinstance(
+            value, bool
+        )
+    python_type = {v: k for k, v in JSON_TYPES.items()}[json_type]
+    return lambda value: isinstance(value, python_type)
+
+
+def _schema_and_validator(name, hint):
+    """The JSON schema of a parameter's type and a function validating values."""
+    description = None
+    if typing.get_origin(hint) is typing.Annotated:
+        hint, *extras = typing.get_args(hint)
+        description = next((e for e in extras if isinstance(e, str)), None)
+
+    origin = typing.get_origin(hint) or hint
+    if origin not in JSON_TYPES:
+        raise TypeError(f"Unsupported type for tool parameter '{name}': {hint}")
+    schema = {"type": JSON_TYPES[origin]}
+    check = _is_type(schema["type"])
+
+    item_args = typing.get_args(hint)
+    if origin is list and item_args:
+        item_schema, check_item = _schema_and_validator(f"{name} items", item_args[0])
+        schema["items"] = item_schema
+
+        def validate(value):
+            if not check(value):
+                raise ToolInputError(f"'{name}' must be an array.")
+            for item in value:
+                check_item(item)
+
+    else:
+
+        def validate(value):
+            if not check(value):
+                raise ToolInputError(f"'{name}' must be of type {schema['type']}.")
+
+    if description:
+        schema["description"] = description
+    return schema, validate
+
+
+class Tool:
+    """A registered tool: its toolSpec and the validators built from it."""
+
+    def __init__(
+        self, func, name, description, context, concurrent, cacheable, prepare
+    ):
+        self.func = func
+        self.prepare = prepare
+        self.name = name
+        self.context = tuple(context)
+        self.concurrent = concurrent
+        self.cacheable = cacheable
+        # Tools that are not safe to run concurrently run one call at a time
+        self.lock = None if concurrent else threading.Lock()
+
+        hints = typing.get_type_hints(func, include_extras=True)
+        properties = {}
+        required = []
+        # (name, validator, required) per parameter
+        self.validators = []
+        for param in inspect.signature(func).parameters.values():
+            if param.name in self.context:
+                continue
+            if param.name not in hints:
+                raise TypeError(f"Tool parameter '{param.name}' needs a type")
+            schema, validate = _schema_and_validator(param.name, hints[param.name])
+            properties[param.name] = schema
+            is_required = param.default is inspect.Parameter.empty
+            if is_required:
+                required.append(param.name)
+            self.validators.append((param.name, validate, is_required))
+
+        if description is None:
+            description = inspect.getdoc(func) or ""
+            description = description.split("\n\n")[0].replace("\n", " ")
+        self.spec = {
+            "toolSpec": {
+                "name": name,
+                "description": description,
+                "inputSchema": {
+                    "json": {
+                        "type": "object",
+                        "properties": properties,
+                        "required": required,
+                    }
+                },
+            }
+        }
+
+    def validate(self, tool_input):
+        """Check the model's input, raising ToolInputError with what is wrong."""
+        if not isinstance(tool_input, dict):
+            raise ToolInputError("The tool input must be an object.")
+        for name, validate, required in self.validators:
+            if name in tool_input:
+                validate(tool_input[name])
+            elif required:
+                raise ToolInputError(f"Missing required parameter '{name}'.")
+
+
+class ToolRegistry:
+    """Tools by name, with their toolSpec list built once."""
+
+    def __init__(self, max_cache_entries=256):
+        self.tools = {}
+        self.max_cache_entries = max_cache_entries
+        self._tool_list = None
+        self._cache_lock = threading.Lock()
+        self._cache = {}
+
+    def tool(
+        self,
+        name=None,
+        description=None,
+        context=(),
+        concurrent=True,
+        cacheable=False,
+        prepare=None,
+    ):
+        """
+        Register a function as a tool, under name (the Python name by default).
+        concurrent=False runs one call of the tool at a time; cacheable=True
+        reuses the result of an earlier call with the same input. prepare is
+        called with the tool's input and returns extra keyword arguments for
+        it, named in context.
+        """
+
+        def decorator(func):
+            tool = Tool(
+                func,
+                name or func.__name__,
+                description,
+                context,
+                concurrent,
+                cacheable,
+                prepare,
+            )
+            self.tools[tool.name] = tool
+            self._tool_list = None
+            return func
+
+        return decorator
+
+    def tool_list(self):
+        """The toolSpec list for toolConfig["tools"], built once."""
+        if self._tool_list is None:
+            self._tool_list = [tool.spec for tool in self.tools.values()]
+        return self._tool_list
+
+    def get(self, name):
+        tool = self.tools.get(name)
+        if tool is None:
+            raise ToolInputError(
+                f"Unknown tool '{name}'. Tools are: {', '.join(self.tools)}"
+            )
+        return tool
+
+    def _arguments(self, tool, tool_input):
+        return {
+            name: tool_input[name]
+            for name, _, _ in tool.validators
+            if name in tool_input
+        }
+
+    def _prepare(self, tool, kwargs):
+        if tool.prepare is None:
+            return {}
+        if tool.lock is not None:
+            with tool.lock:
+                return tool.prepare(**kwargs)
+        return tool.prepare(**kwargs)
+
+    def prepare(self, tool_use_block):
+        """
+        Validate the input of a toolUse block and run its tool's prepare step.
+        Returns the keyword arguments to pass to run() as prepared.
+        """
+        tool = self.get(tool_use_block["name"])
+        tool_input = tool_use_block.get("input") or {}
+        tool.validate(tool_input)
+        return self._prepare(tool, self._arguments(tool, tool_input))
+
+    def run(self, tool_use_block, prepared=None, **context):
+        """
+        Validate the input of a toolUse block and call its tool, passing the
+        context keyword arguments it declared and what its prepare step
+        returned (prepared, or run now). Returns the tool's result.
+        """
+        tool = self.get(tool_use_block["name"])
+        tool_input = tool_use_block.get("input") or {}
+        tool.validate(tool_input)
+
+        key = None
+        if tool.cacheable:
+            key = (tool.name, json.dumps(tool_input, sort_keys=True))
+            with self._cache_lock:
+                if key in self._cache:
+                    return self._cache[key]
+
+        kwargs = self._arguments(tool, tool_input)
+        if prepared is None:
+            prepared = self._prepare(tool, kwargs)
+        available = dict(context, **prepared)
+        for name in tool.context:
+            kwargs[name] = available[name]
+        if tool.lock is not None:
+            with tool.lock:
+                result = tool.func(**kwargs)
+        else:
+            result = tool.func(**kwargs)
+
+        if key is not None:
+            with self._cache_lock:
+                if len(self._cache) >= self.max_cache_entries:
+                    # Drop the oldest entry; dicts keep insertion order
+                    self._cache.pop(next(iter(self._cache)))
+                self._cache[key] = result
+        return result
@@ -0,0 +1,155 @@
+"""
+Metadata of CSV objects in S3 (row count, header, column types and stats),
+cached per object version so unchanged files are not parsed again.
+"""
+
+import json
+import threading
+
+from botocore.exceptions import ClientError
+
+import agent_logging
+import csv_stream
+
+# Appended to the object key to name the optional sidecar object
+SIDECAR_SUFFIX = ".metadata.json"
+
+logger = agent_logging.get_logger(__name__)
+
+
+def object_version(head):
+    """The (ETag, LastModified) pair identifying one version of an S3 object."""
+    last_modified = head.get("LastModified")
+    if last_modified is not None and hasattr(last_modified, "isoformat"):
+        last_modified = last_modified.isoformat()
+    return head.get("ETag"), last_modified
+
+
+def compute_metadata(chunks):
+    """Row count, header and per-column stats of a CSV stream, in one pass."""
+    header, count, stats = csv_stream.column_stats(csv_stream.iter_rows(chunks))
+    return {
+        "rows": count,
+        "header": header,
+        "columns": {name: column.to_dict() for name, column in stats.items()},
+    }
+
+
+class CSVMetadataCache:
+    """
+    Metadata of CSV objects, keyed on their ETag and LastModified. A cheap
+    head_object tells whether the cached entry still describes the object; only
+    a new version is downloaded and parsed. Entries live as long as the warm
+    container, and with sidecar=True are also written next to the object in S3
+    (<key>.metadata.json) so cold containers can reuse them. row_count() only
+    counts the rows of a version whose metadata is not cached yet.
+    """
+
+    def __init__(self, s3_client, sidecar=False, max_entries=64):
+        self.s3_client = s3_client
+        self.sidecar = sidecar
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Row counts of versions whose metadata was not computed
+        self._counts = {}
+
+    def _cached(self, entries, bucket, key, version):
+        with self._lock:
+            entry = entries.get((bucket, key))
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        return None
+
+    def _store(self, entries, bucket, key, version, value):
+        with self._lock:
+            entries.pop((bucket, key), None)
+            if len(entries) >= self.max_entries:
+                entries.pop(next(iter(entries)))
+            entries[(bucket, key)] = (version, value)
+
+    def _head(self, bucket, key):
+        return object_version(self.s3_client.head_object(Bucket=bucket, Key=key))
+
+    def _body(self, bucket, key, version):
+        # IfMatch makes sure the bytes read are the version checked with HEAD
+        body = self.s3_client.get_object(Bucket=bucket, Key=key, IfMatch=version[0])
+        return csv_stream.iter_chunks(body["Body"])
+
+    def get(self, bucket, key):
+        """Return the metadata of s3://bucket/key, computing it if it changed."""
+        version = self._head(bucket, key)
+        metadata = self._cached(self._entries, bucket, key, version)
+        if metadata is not None:
+            return metadata
+
+        metadata = self._read_sidecar(bucket, key, version) if self.sidecar else None
+        if metadata is None:
+            logger.info("Computing metadata of s3://%s/%s", bucket, key)
+            metadata = compute_metadata(self._body(bucket, key, version))
+            if self.sidecar:
+                self._write_sidecar(bucket, key, version, metadata)
+
+        self._store(self._entries, bucket, key, version, metadata)
+        return metadata
+
+    def row_count(self, bucket, key):
+        """
+        Return the number of data rows of s3://bucket/key, from the metadata when
+        it is cached. Otherwise the record ends are counted in the raw bytes,
+        without parsing fields or computing column stats, and the count is
+        cached on its own.
+        """
+        version = self._head(bucket, key)
+        metadata = self._cached(self._entries, bucket, key, version)
+        if metadata is not None:
+            return metadata["rows"]
+        rows = self._cached(self._counts, bucket, key, version)
+        if rows is not None:
+            return rows
+
+        metadata = self._read_sidecar(bucket, key, version) if self.sidecar else None
+        if metadata is not None:
+            self._store(self._entries, bucket, key, version, metadata)
+            return metadata["rows"]
+        logger.info("Counting the rows of s3://%s/%s", bucket, key)
+        records = csv_stream.count_records(self._body(bucket, key, version))
+        rows = max(records - 1, 0)  # Without the header row
+        self._store(self._counts, bucket, key, version, rows)
+        return rows
+
+    def version(self, bucket, key):
+        """The (ETag, LastModified) of the object as of the last get()."""
+        with self._lock:
+            entry = self._entries.get((bucket, key))
+        return entry[0] if entry is not None else None
+
+    def _read_sidecar(self, bucket, key, version):
+        try:
+            response = self.s3_client.get_object(
+                Bucket=bucket, Key=key + SIDECAR_SUFFIX
+            )
+            stored = json.loads(response["Body"].read())
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                logger.warning("Could not read the metadata sidecar: %s", e)
+            return None
+        except ValueError:
+            logger.warning("Ignoring a malformed metadata sidecar for %s", key)
+            return None
+        if [stored.get("etag"), stored.get("last_modified")] != list(version):
+            return None
+        return stored["metadata"]
+
+    def _write_sidecar(self, bucket, key, version, metadata):
+        body = {"etag": version[0], "last_modified": version[1], "metadata": metadata}
+        try:
+            self.s3_client.put_object(
+                Bucket=bucket,
+                Key=key + SIDECAR_SUFFIX,
+                Body=json.dumps(body).encode("utf-8"),
+                ContentType="application/json",
+            )
+        except ClientError as e:
+            # The in-process entry still works, only cold starts lose the reuse
+            logger.warning("Could not write the metadata sidecar: %s", e)
@@ -0,0 +1,302 @@
+"""
+Small columnar query engine over CSV streams.
+
+Filters (where) and projections are pushed down into the scan: rows are tested
+on their raw cells as they stream in, and only the needed columns of matching
+rows are loaded, numbers into float64 arrays and text into lists. Aggregations,
+optionally grouped, then run over those columns, with NumPy when it is
+installed (e.g. from a Lambda layer) and in plain Python otherwise.
+"""
+
+import array
+import math
+import operator
+import re
+
+import csv_stream
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Comparison operators accepted in where conditions
+OPERATORS = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+AGGREGATES = ("count", "sum", "avg", "min", "max")
+
+# Column types (from csv_stream.ColumnStats) compared and aggregated as numbers
+NUMERIC_TYPES = ("integer", "number")
+
+_CONDITION = re.compile(r"^\s*(.+?)\s*(==|!=|>=|<=|=|>|<)\s*(.+?)\s*$", re.S)
+_AND = re.compile(r"\s+and\s+", re.I)
+
+
+class QueryError(ValueError):
+    """A query the model should rephrase, e.g. an unknown column."""
+
+
+def is_null(cell):
+    return cell.strip().lower() in csv_stream.NULL_VALUES
+
+
+def to_number(cell):
+    """The cell as a float, NaN for missing or non-numeric values."""
+    if is_null(cell):
+        return math.nan
+    try:
+        return float(cell)
+    except ValueError:
+        return math.nan
+
+
+def _unquote(text):
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"`":
+        return text[1:-1]
+    return text
+
+
+def split_columns(text, types):
+    """Parse a comma-separated list of column names, checking they exist."""
+    names = [_unquote(name.strip()) for name in text.split(",") if name.strip()]
+    missing = [name for name in names if name not in types]
+    if missing:
+        raise QueryError(
+            f"Unknown columns: {', '.join(missing)}. "
+            f"Columns are: {', '.join(types)}"
+        )
+    return names
+
+
+class Condition:
+    """One `<column> <operator> <value>` test, compiled for the column's type."""
+
+    __slots__ = ("column", "op", "target", "numeric", "compare")
+
+    def __init__(self, column, op, value, numeric):
+        self.column = column
+        self.op = op
+        self.numeric = numeric
+        self.compare = OPERATORS[op]
+        if numeric:
+            try:
+                self.target = float(value)
+            except ValueError:
+                raise QueryError(f"'{column}' is numeric, '{value}' is not a number.")
+        else:
+            self.target = value
+
+    def test(self, cell):
+        """Test a raw CSV cell."""
+        return self.test_value(to_number(cell) if self.numeric else cell)
+
+    def test_value(self, value):
+        """Test a loaded value (float for numbers); missing values never match."""
+        if self.numeric:
+            return value == value and self.compare(value, self.target)
+        return not is_null(value) and self.compare(value, self.target)
+
+    def may_match(self, low, high):
+        """
+        Whether any value between low and high (a chunk's zone map, None when it
+        has no values) can match, so chunks that cannot are skipped unread.
+        """
+        if low is None:
+            return False
+        target = self.target
+        if self.op in ("=", "=="):
+            return low <= target <= high
+        if self.op == "!=":
+            return not low == high == target
+        if self.op in (">", ">="):
+            return self.compare(high, target)
+        return self.compare(low, target)
+
+
+def parse_where(where, types):
+    """
+    Parse conditions joined by "and", e.g. `price > 10 and region = "EU"`, into
+    Conditions. types maps each column to its csv_stream type.
+    """
+    conditions = []
+    for clause in _AND.split(where.strip()) if where.strip() else []:
+        match = _CONDITION.match(clause)
+        if match is None:
+            raise QueryError(
+                f"Cannot parse the condition '{clause}'; "
+                "use <column> <operator> <value> joined by 'and'."
+            )
+        column, op, value = match.groups()
+        column = _unquote(column)
+        if column not in types:
+            raise QueryError(
+                f"Unknown column '{column}'. Columns are: {', '.join(types)}"
+            )
+        conditions.append(
+            Condition(column, op, _unquote(value), types[column] in NUMERIC_TYPES)
+        )
+    return conditions
+
+
+class Table:
+    """The loaded columns of the matching rows."""
+
+    def __init__(self, text_columns, number_columns):
+        self.columns = {name: [] for name in text_columns}
+        for name in number_columns:
+            self.columns[name] = array.array("d")
+        # Rows that matched, which may be more than the rows kept
+        self.matched = 0
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def values(self, name):
+        """A column, as a NumPy view without copying when NumPy is installed."""
+        column = self.columns[name]
+        if np is not None and isinstance(column, array.array):
+            return np.frombuffer(column, dtype=np.float64, count=len(column))
+        return column
+
+
+def load(rows, conditions=(), text_columns=(), number_columns=(), max_rows=None):
+    """
+    Scan a row iterator whose first row is the header and load the given
+    columns of the rows matching every condition. With max_rows, rows past the
+    limit are only counted.
+    """
+    rows = iter(rows)
+    header = next(rows, [])
+    index = {name: i for i, name in enumerate(header)}
+    width = len(header)
+
+    table = Table(text_columns, number_columns)
+    tests = [(index[c.column], c.test) for c in conditions]
+    loaders = [(index[name], table.columns[name].append, str) for name in text_columns]
+    loaders += [
+        (index[name], table.columns[name].append, to_number) for name in number_columns
+    ]
+    for row in rows:
+        if len(row) < width:
+            row = row + [""] * (width - len(row))
+        if tests and not all(test(row[i]) for i, test in tests):
+            continue
+        table.matched += 1
+        if max_rows is None or table.matched <= max_rows:
+            for i, append, convert in loaders:
+                append(convert(row[i]))
+    return table
+
+
+def _group_codes(table, group_by):
+    """A group number per row, and the group keys in order of first appearance."""
+    columns = []
+    for name in group_by:
+        column = table.columns[name]
+        if isinstance(column, array.array):
+            # NaN is not equal to itself, so missing numbers group under None
+            column = [None if value != value else value for value in column]
+        columns.append(column)
+
+    keys = {}
+    codes = array.array("q")
+    for key in zip(*columns):
+        code = keys.get(key)
+        if code is None:
+            code = keys[key] = len(keys)
+        codes.append(code)
+    return codes, list(keys)
+
+
+def _aggregate_numpy(metric, values, codes, groups):
+    codes = np.frombuffer(codes, dtype=np.int64, count=len(codes))
+    if values is None:
+        return np.bincount(codes, minlength=groups).tolist()
+    values = np.asarray(values)
+    present = ~np.isnan(values)
+    codes, values = codes[present], values[present]
+    counts = np.bincount(codes, minlength=groups)
+    if metric == "count":
+        return counts.tolist()
+    if metric in ("sum", "avg"):
+        sums = np.bincount(codes, weights=values, minlength=groups)
+        if metric == "sum":
+            return sums.tolist()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (sums / counts).tolist()
+    result = np.full(groups, np.inf if metric == "min" else -np.inf)
+    (np.minimum if metric == "min" else np.maximum).at(result, codes, values)
+    result[counts == 0] = np.nan
+    return result.tolist()
+
+
+def _aggregate_python(metric, values, codes, groups):
+    counts = [0] * groups
+    if values is None:
+        for code in codes:
+            counts[code] += 1
+        return counts
+    totals = [0.0] * groups
+    extremes = [math.nan] * groups
+    better = operator.lt if metric == "min" else operator.gt
+    for code, value in zip(codes, values):
+        if value != value:  # NaN, a missing value
+            continue
+        counts[code] += 1
+        totals[code] += value
+        if counts[code] == 1 or better(value, extremes[code]):
+            extremes[code] = value
+    if metric == "count":
+        return counts
+    if metric == "sum":
+        return totals
+    if metric == "avg":
+        return [t / c if c else math.nan for t, c in zip(totals, counts)]
+    return extremes
+
+
+def aggregate(table, metric, column=None, group_by=()):
+    """
+    Compute metric (count, sum, avg, min or max) of a number column of the
+    table (only count for text columns, or for the rows when column is None),
+    per group of the group_by columns. Returns [(group key tuple, value)], None
+    for no value.
+    """
+    if metric not in AGGREGATES:
+        raise QueryError(
+            f"Unknown aggregate '{metric}'. Use one of: {', '.join(AGGREGATES)}"
+        )
+    if column is None and metric != "count":
+        raise QueryError(f"The '{metric}' aggregate needs a column.")
+    if column is None and not group_by:
+        # Counting the matching rows needs no column at all
+        return [((), table.matched)]
+    if group_by:
+        codes, keys = _group_codes(table, group_by)
+    else:
+        codes, keys = array.array("q", bytes(8 * len(table))), [()]
+    values = table.values(column) if column else None
+    if isinstance(values, list):
+        # Counting a text column counts its values that are not missing
+        values = array.array(
+            "d", (math.nan if is_null(value) else 0.0 for value in values)
+        )
+        if np is not None:
+            values = np.frombuffer(values, dtype=np.float64, count=len(values))
+
+    if np is not None:
+        results = _aggregate_numpy(metric, values, codes, len(keys))
+    else:
+        results = _aggregate_python(metric, values, codes, len(keys))
+    return [
+        (key, None if isinstance(value, float) and not math.isfinite(value) else value)
+        for key, value in zip(keys, results)
+    ]
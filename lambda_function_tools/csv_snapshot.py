@@ -0,0 +1,325 @@
+"""
+Binary columnar snapshots of CSV objects, for datasets queried repeatedly.
+
+A snapshot stores the rows in chunks of CHUNK_ROWS. Every chunk holds every
+column: numbers as float64 (NaN when missing), text as int64 end offsets (in
+characters) and UTF-8 bytes. A min/max zone map per column and chunk lets a scan skip the
+chunks no condition can match. The layout puts the manifest last, as Parquet
+does, so the file is written in one pass:
+
+    MAGIC | column blocks (8-byte aligned) | manifest JSON | u64 length | MAGIC
+
+Snapshots are memory-mapped: numeric columns are read without copying, and
+only the chunks a query touches are paged in. The manifest records the ETag
+and LastModified of the CSV it was built from; any other version is rebuilt.
+"""
+
+import array
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import struct
+import threading
+
+from botocore.exceptions import ClientError
+
+import agent_logging
+import csv_query
+import csv_stream
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b"CSVSNAP1"
+
+# Rows per chunk, the unit zone maps skip
+CHUNK_ROWS = 65536
+
+# Appended to the object key to name the snapshot uploaded next to it
+SNAPSHOT_SUFFIX = ".snapshot"
+
+logger = agent_logging.get_logger(__name__)
+
+
+class _BlockWriter:
+    """Writes blocks at 8-byte aligned offsets, so they can be cast in place."""
+
+    def __init__(self, file):
+        self.file = file
+        self.offset = 0
+        self.write(MAGIC)
+
+    def write(self, data):
+        offset = self.offset
+        padding = -len(data) % 8
+        self.file.write(data + b"\0" * padding)
+        self.offset += len(data) + padding
+        return offset, len(data)
+
+
+def _write_chunk(writer, numeric, buffers):
+    columns = []
+    for is_number, values in zip(numeric, buffers):
+        if is_number:
+            present = [value for value in values if value == value]
+            offset, length = writer.write(values.tobytes())
+            columns.append(
+                {
+                    "offset": offset,
+                    "length": length,
+                    "min": min(present) if present else None,
+                    "max": max(present) if present else None,
+                }
+            )
+        else:
+            present = [value for value in values if not csv_query.is_null(value)]
+            # Ends count characters, so a chunk is decoded once and then sliced
+            ends = array.array("q", itertools.accumulate(map(len, values)))
+            offset, length = writer.write(ends.tobytes())
+            data_offset, data_length = writer.write("".join(values).encode("utf-8"))
+            columns.append(
+                {
+                    "offset": offset,
+                    "length": length,
+                    "data_offset": data_offset,
+                    "data_length": data_length,
+                    "min": min(present) if present else None,
+                    "max": max(present) if present else None,
+                }
+            )
+    return {"rows": len(buffers[0]) if buffers else 0, "columns": columns}
+
+
+def build_snapshot(rows, types, path, version, chunk_rows=CHUNK_ROWS):
+    """
+    Write the snapshot of a row iterator whose first row is the header. types
+    maps columns to their csv_stream type; numeric ones are stored as float64.
+    """
+    rows = iter(rows)
+    header = next(rows, [])
+    numeric = [types.get(name) in csv_query.NUMERIC_TYPES for name in header]
+
+    def new_buffers():
+        return [array.array("d") if is_number else [] for is_number in numeric]
+
+    chunks = []
+    total = 0
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        writer = _BlockWriter(file)
+        buffers = new_buffers()
+        for row in rows:
+            for i, is_number in enumerate(numeric):
+                cell = row[i] if i < len(row) else ""
+                buffers[i].append(csv_query.to_number(cell) if is_number else cell)
+            total += 1
+            if total % chunk_rows == 0:
+                chunks.append(_write_chunk(writer, numeric, buffers))
+                buffers = new_buffers()
+        if total % chunk_rows or not chunks:
+            chunks.append(_write_chunk(writer, numeric, buffers))
+
+        manifest = {
+            "version": list(version),
+            "header": header,
+            "numeric": numeric,
+            "rows": total,
+            "chunks": chunks,
+        }
+        encoded = json.dumps(manifest).encode("utf-8")
+        file.write(encoded + struct.pack("<Q", len(encoded)) + MAGIC)
+    # Readers never see a partly written snapshot
+    os.replace(temporary, path)
+
+
+class Snapshot:
+    """A memory-mapped snapshot file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self._mmap
+        if len(data) < 24 or data[:8] != MAGIC or data[-8:] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a CSV snapshot")
+        (length,) = struct.unpack("<Q", data[-16:-8])
+        manifest = json.loads(data[-16 - length : -16])
+        self.version = tuple(manifest["version"])
+        self.header = manifest["header"]
+        self.numeric = manifest["numeric"]
+        self.rows = manifest["rows"]
+        self.chunks = manifest["chunks"]
+        self.index = {name: i for i, name in enumerate(self.header)}
+
+    def close(self):
+        self._mmap.close()
+
+    def _numbers(self, block):
+        count = block["length"] // 8
+        if np is not None:
+            return np.frombuffer(
+                self._mmap, dtype=np.float64, count=count, offset=block["offset"]
+            )
+        start = block["offset"]
+        return memoryview(self._mmap)[start : start + block["length"]].cast("d")
+
+    def _texts(self, block):
+        ends = array.array("q")
+        start = block["offset"]
+        ends.frombytes(self._mmap[start : start + block["length"]])
+        start = block["data_offset"]
+        text = self._mmap[start : start + block["data_length"]].decode("utf-8")
+        return [
+            text[begin:end] for begin, end in zip(itertools.chain((0,), ends), ends)
+        ]
+
+    def scan(self, conditions=(), text_columns=(), number_columns=(), max_rows=None):
+        """
+        csv_query.load over the snapshot: skip the chunks whose zone maps rule
+        out a condition, then load the given columns of the matching rows.
+        """
+        table = csv_query.Table(text_columns, number_columns)
+        skipped = 0
+        for chunk in self.chunks:
+            blocks = chunk["columns"]
+            zones = [blocks[self.index[c.column]] for c in conditions]
+            if not all(
+                c.may_match(zone["min"], zone["max"])
+                for c, zone in zip(conditions, zones)
+            ):
+                skipped += 1
+                continue
+
+            loaded = {}
+
+            def column(name):
+                if name not in loaded:
+                    i = self.index[name]
+                    read = self._numbers if self.numeric[i] else self._texts
+                    loaded[name] = read(blocks[i])
+                return loaded[name]
+
+            selected = self._select(chunk["rows"], conditions, column)
+            table.matched += len(selected)
+            if max_rows is not None:
+                kept = len(next(iter(table.columns.values()), ()))
+                selected = selected[: max(max_rows - kept, 0)]
+            for name in text_columns:
+                values = column(name)
+                table.columns[name].extend(values[i] for i in selected)
+            for name in number_columns:
+                values = column(name)
+                if np is not None:
+                    table.columns[name].frombytes(values[selected].tobytes())
+                else:
+                    table.columns[name].extend(values[i] for i in selected)
+        logger.debug("Skipped %d of %d chunks", skipped, len(self.chunks))
+        return table
+
+    def _select(self, rows, conditions, column):
+        """The indexes of the chunk's rows that match every condition."""
+        if np is not None:
+            mask = np.ones(rows, dtype=bool)
+            for condition in conditions:
+                values = column(condition.column)
+                if condition.numeric:
+                    # NaN compares false, except with !=
+                    with np.errstate(invalid="ignore"):
+                        mask &= ~np.isnan(values) & condition.compare(
+                            values, condition.target
+                        )
+                else:
+                    mask &= np.fromiter(
+                        map(condition.test_value, values), dtype=bool, count=rows
+                    )
+            return np.flatnonzero(mask)
+
+        selected = range(rows)
+        for condition in conditions:
+            values = column(condition.column)
+            selected = [i for i in selected if condition.test_value(values[i])]
+        return selected
+
+
+class SnapshotStore:
+    """
+    Snapshots of CSV objects in a local folder, and with upload=True also in S3
+    next to the object (<key>.snapshot) for reuse across cold starts. Each is
+    opened once per warm container and rebuilt when the object changes.
+    """
+
+    def __init__(self, s3_client, folder, upload=False):
+        self.s3_client = s3_client
+        self.folder = folder
+        self.upload = upload
+        self._lock = threading.Lock()
+        self._open = {}
+
+    def _path(self, bucket, key):
+        name = hashlib.sha256(f"{bucket}/{key}".encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.folder, name + SNAPSHOT_SUFFIX)
+
+    def get(self, bucket, key, version, types):
+        """Return the Snapshot of this version of s3://bucket/key."""
+        version = tuple(version)
+        with self._lock:
+            snapshot = self._open.get((bucket, key))
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+            if snapshot is not None:
+                snapshot.close()
+
+            os.makedirs(self.folder, exist_ok=True)
+            path = self._path(bucket, key)
+            snapshot = self._open_local(path, version)
+            if snapshot is None and self.upload:
+                snapshot = self._download(bucket, key, path, version)
+            if snapshot is None:
+                snapshot = self._build(bucket, key, path, version, types)
+            self._open[(bucket, key)] = snapshot
+            return snapshot
+
+    def _open_local(self, path, version):
+        try:
+            snapshot = Snapshot(path)
+        except (OSError, ValueError):
+            return None
+        if snapshot.version != version:
+            snapshot.close()
+            return None
+        return snapshot
+
+    def _download(self, bucket, key, path, version):
+        try:
+            self.s3_client.download_file(bucket, key + SNAPSHOT_SUFFIX, path + ".tmp")
+        except ClientError as e:
+            logger.info("No snapshot in S3 for %s: %s", key, e)
+            return None
+        os.replace(path + ".tmp", path)
+        return self._open_local(path, version)
+
+    def _build(self, bucket, key, path, version, types):
+        logger.info("Building the snapshot of s3://%s/%s", bucket, key)
+        # IfMatch makes sure the snapshot holds the version it is labeled with
+        body = self.s3_client.get_object(Bucket=bucket, Key=key, IfMatch=version[0])
+        rows = csv_stream.iter_rows(csv_stream.iter_chunks(body["Body"]))
+        try:
+            build_snapshot(rows, types, path, version)
+        except OSError:
+            # e.g. /tmp is full: drop the partial file before the error is raised
+            try:
+                os.remove(path + ".tmp")
+            except OSError:
+                pass
+            raise
+        if self.upload:
+            try:
+                self.s3_client.upload_file(path, bucket, key + SNAPSHOT_SUFFIX)
+            except ClientError as e:
+                logger.warning("Could not upload the snapshot: %s", e)
+        return Snapshot(path)
@@ -0,0 +1,202 @@
+"""
+Single pass, bounded memory readers for CSV objects streamed from S3.
+"""
+
+import codecs
+import csv
+import math
+
+# Bytes requested from the S3 body at a time
+CHUNK_SIZE = 1024 * 1024
+
+# Values counted as missing
+NULL_VALUES = frozenset(["", "na", "n/a", "nan", "null", "none"])
+
+
+def iter_chunks(body, chunk_size=CHUNK_SIZE):
+    """Yield the bytes of an S3 StreamingBody (or any file object) in chunks."""
+    while True:
+        chunk = body.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def count_records(chunks):
+    """
+    Count the CSV records in a stream of byte chunks without parsing fields.
+    Newlines inside quoted fields are not record ends; an escaped quote ("")
+    toggles the quote state twice, so it needs no special case.
+    """
+    records = 0
+    in_quotes = False
+    last = b"\n"
+    for chunk in chunks:
+        if not in_quotes and b'"' not in chunk:
+            # Fast path, most chunks of most files have no quotes at all
+            records += chunk.count(b"\n")
+        else:
+            parts = chunk.split(b'"')
+            for index, part in enumerate(parts):
+                if not in_quotes:
+                    records += part.count(b"\n")
+                if index < len(parts) - 1:
+                    in_quotes = not in_quotes
+        last = chunk[-1:]
+    # The last record may have no trailing newline
+    if last != b"\n":
+        records += 1
+    return records
+
+
+def iter_lines(chunks, encoding="utf-8"):
+    """Decode byte chunks into lines (with their line endings) for csv.reader."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pending = ""
+    for chunk in chunks:
+        # Split on "\n" only; csv handles "\r\n" and other characters in fields
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def iter_rows(chunks, encoding="utf-8"):
+    """Yield the header and then each row of a CSV stream, as lists of strings."""
+    return csv.reader(iter_lines(chunks, encoding))
+
+
+class DistinctCounter:
+    """
+    HyperLogLog estimate of the number of distinct values, in 2**precision
+    bytes whatever the number of values (about 1.6% error at the default).
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        # Python's string hash is randomized per process, which is fine for an
+        # estimate made within one pass
+        h = hash(value) & 0xFFFFFFFFFFFFFFFF
+        index = h & ((1 << self.precision) - 1)
+        rest = h >> self.precision
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+
+def _number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class ColumnStats:
+    """Running count, nulls, min/max and distinct estimate of one column."""
+
+    __slots__ = (
+        "name",
+        "count",
+        "nulls",
+        "numeric",
+        "integer",
+        "min_number",
+        "max_number",
+        "min_text",
+        "max_text",
+        "distinct",
+    )
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.nulls = 0
+        self.numeric = True
+        self.integer = True
+        self.min_number = self.max_number = None
+        self.min_text = self.max_text = None
+        self.distinct = DistinctCounter()
+
+    def add(self, value):
+        self.count += 1
+        if value.strip().lower() in NULL_VALUES:
+            self.nulls += 1
+            return
+        self.distinct.add(value)
+
+        if self.min_text is None or value < self.min_text:
+            self.min_text = value
+        if self.max_text is None or value > self.max_text:
+            self.max_text = value
+
+        if self.numeric:
+            number = _number(value)
+            if number is None or math.isnan(number):
+                self.numeric = False
+                return
+            if self.integer and not number.is_integer():
+                self.integer = False
+            if self.min_number is None or number < self.min_number:
+                self.min_number = number
+            if self.max_number is None or number > self.max_number:
+                self.max_number = number
+
+    @property
+    def type(self):
+        if self.count == self.nulls:
+            return "empty"
+        if not self.numeric:
+            return "string"
+        return "integer" if self.integer else "number"
+
+    def to_dict(self):
+        if self.type == "integer":
+            low, high = int(self.min_number), int(self.max_number)
+        elif self.type == "number":
+            low, high = self.min_number, self.max_number
+        else:
+            low, high = self.min_text, self.max_text
+        return {
+            "type": self.type,
+            "count": self.count,
+            "nulls": self.nulls,
+            "min": low,
+            "max": high,
+            "distinct_estimate": self.distinct.estimate(),
+        }
+
+
+def column_stats(rows, columns=None):
+    """
+    Compute ColumnStats for each column (or only the named columns) of a row
+    iterator whose first row is the header. Returns (header, row count, stats).
+    """
+    rows = iter(rows)
+    header = next(rows, [])
+    wanted = [
+        (index, ColumnStats(name))
+        for index, name in enumerate(header)
+        if not columns or name in columns
+    ]
+    count = 0
+    for row in rows:
+        count += 1
+        for index, stats in wanted:
+            stats.add(row[index] if index < len(row) else "")
+    return header, count, {stats.name: stats for _, stats in wanted}
@@ -1,52 +1,233 @@
 import csv
 import json
+import math
 import os
 
-import boto3
+import agent_logging
+import aws_clients
+import csv_metadata
+import csv_query
+import csv_snapshot
+import csv_stream
+from action_group import ActionGroupApp, ParameterError
 
 S3_BUCKET = os.environ["S3_BUCKET"]
 S3_OBJECT = os.environ["S3_OBJECT"]
 
+# "stream" reads the S3 body in chunks; "download" copies the object to /tmp first
+CSV_READ_MODE = os.getenv("CSV_READ_MODE", "stream")
 
-def lambda_handler(event, context):
-    # Print the received event to the logs
-    print("Received event: ")
-    print(event)
-
-    # Initialize response code to None
-    response_code = None
-
-    # Extract the action group, api path, and parameters from the prediction
-    agent = event["agent"]
-    actionGroup = event["actionGroup"]
-    function = event["function"]
-    parameters = event.get("parameters", [])
-
-    # Check the api path to determine which tool function to call
-    s3 = boto3.client("s3")
-    s3.download_file(S3_BUCKET, S3_OBJECT, "/tmp/data.csv")
-
-    # Read CSV file and count rows
-    with open("/tmp/data.csv", "r") as file:
-        csv_reader = csv.reader(file)
-        count = sum(1 for row in csv_reader) - 1  # Subtract 1 to exclude header row
-
-    response_body = {"TEXT": {"body": str(count)}}
-    response_code = 200
-
-    # Print the response body to the logs
-    print(f"Response body: {response_body}")
-
-    # Create a dictionary containing the response details
-    action_response = {
-        "actionGroup": actionGroup,
-        "function": function,
-        "functionResponse": {"responseBody": response_body},
-    }
-
-    # Return the list of responses as a dictionary
-    api_response = {
-        "messageVersion": event["messageVersion"],
-        "response": action_response,
-    }
-    return api_response
+# Also keep the metadata in S3 next to the object, for reuse across cold starts
+CSV_METADATA_SIDECAR = os.getenv("CSV_METADATA_SIDECAR", "false").lower() == "true"
+
+# Columnar snapshots for repeated queries: "local" keeps them in CSV_SNAPSHOT_DIR,
+# "s3" also uploads them next to the object, "off" (default) streams the CSV every
+# time. A snapshot takes about as much room in /tmp as the CSV itself.
+CSV_SNAPSHOT = os.getenv("CSV_SNAPSHOT", "off").lower()
+CSV_SNAPSHOT_DIR = os.getenv("CSV_SNAPSHOT_DIR", "/tmp/csv_snapshots")
+
+logger = agent_logging.get_logger(__name__)
+
+
+def open_chunks():
+    """Return the object's bytes as an iterator of chunks, streamed from S3."""
+    s3 = aws_clients.get_client("s3")
+    body = s3.get_object(Bucket=S3_BUCKET, Key=S3_OBJECT)["Body"]
+    return csv_stream.iter_chunks(body)
+
+
+_metadata_cache = None
+
+
+def metadata_cache():
+    """The CSVMetadataCache of this container."""
+    global _metadata_cache
+    if _metadata_cache is None:
+        _metadata_cache = csv_metadata.CSVMetadataCache(
+            aws_clients.get_client("s3"), sidecar=CSV_METADATA_SIDECAR
+        )
+    return _metadata_cache
+
+
+def metadata():
+    """Row count, header and column stats of the object, cached per ETag."""
+    return metadata_cache().get(S3_BUCKET, S3_OBJECT)
+
+
+_snapshot_store = None
+
+
+def scan(types, conditions, text_columns=(), number_columns=(), max_rows=None):
+    """
+    Load the given columns of the rows matching conditions, from the columnar
+    snapshot when enabled and from the CSV stream otherwise, or when the
+    snapshot cannot be written or read (e.g. /tmp is full). types is the result
+    of column_types(), which also checks the object's version.
+    """
+    global _snapshot_store
+    if CSV_SNAPSHOT != "off":
+        if _snapshot_store is None:
+            _snapshot_store = csv_snapshot.SnapshotStore(
+                aws_clients.get_client("s3"),
+                CSV_SNAPSHOT_DIR,
+                upload=CSV_SNAPSHOT == "s3",
+            )
+        version = metadata_cache().version(S3_BUCKET, S3_OBJECT)
+        try:
+            snapshot = _snapshot_store.get(S3_BUCKET, S3_OBJECT, version, types)
+            return snapshot.scan(conditions, text_columns, number_columns, max_rows)
+        except OSError as e:
+            logger.warning("Snapshot unavailable, streaming the CSV: %s", e)
+
+    return csv_query.load(
+        csv_stream.iter_rows(open_chunks()),
+        conditions,
+        text_columns,
+        number_columns,
+        max_rows,
+    )
+
+
+def column_types():
+    """The csv_stream type of each column, from the metadata cache."""
+    return {name: stats["type"] for name, stats in metadata()["columns"].items()}
+
+
+app = ActionGroupApp()
+
+
+@app.function("count_rows", default=True)
+def count_rows():
+    """Count the data rows of the CSV file at S3_BUCKET/S3_OBJECT."""
+    if CSV_READ_MODE == "download":
+        s3 = aws_clients.get_client("s3")
+        s3.download_file(S3_BUCKET, S3_OBJECT, "/tmp/data.csv")
+
+        # Read CSV file and count rows
+        with open("/tmp/data.csv", "r") as file:
+            csv_reader = csv.reader(file)
+            count = sum(1 for row in csv_reader) - 1  # Subtract 1 to exclude header row
+        return str(count)
+
+    return str(metadata_cache().row_count(S3_BUCKET, S3_OBJECT))
+
+
+@app.function("column_stats")
+def column_stats(columns: str = ""):
+    """
+    Type, null count, min/max and distinct count estimate of each column, or of
+    the comma-separated columns given. Computed in one streaming pass when the
+    object changes, then served from the metadata cache.
+    """
+    wanted = {name.strip() for name in columns.split(",") if name.strip()}
+    info = metadata()
+    header = info["header"]
+    missing = sorted(wanted - set(header))
+    if missing:
+        return (
+            f"Unknown columns: {', '.join(missing)}. Columns are: {', '.join(header)}"
+        )
+
+    return json.dumps(
+        {
+            "rows": info["rows"],
+            "columns": {
+                name: stats
+                for name, stats in info["columns"].items()
+                if not wanted or name in wanted
+            },
+        }
+    )
+
+
+@app.function("describe_columns")
+def describe_columns():
+    """The row count and the name and type of each column."""
+    return json.dumps({"rows": metadata()["rows"], "columns": column_types()})
+
+
+def _by_type(names, types):
+    """Split column names into the text and number columns to load."""
+    numbers = [name for name in names if types[name] in csv_query.NUMERIC_TYPES]
+    return [name for name in names if name not in numbers], numbers
+
+
+def _json_value(value, column_type):
+    """A loaded value for the JSON output: ints for integer columns, None if missing."""
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            return None
+        if column_type == "integer" and value.is_integer():
+            return int(value)
+    return value
+
+
+@app.function("query_rows")
+def query_rows(columns: str = "", where: str = "", limit: int = 20):
+    """
+    The given columns (all by default) of the rows matching where, e.g.
+    `price > 10 and region = "EU"`, with the number of matching rows.
+    """
+    types = column_types()
+    try:
+        names = csv_query.split_columns(columns, types) or list(types)
+        conditions = csv_query.parse_where(where, types)
+    except csv_query.QueryError as e:
+        raise ParameterError(str(e))
+
+    text_columns, number_columns = _by_type(names, types)
+    table = scan(types, conditions, text_columns, number_columns, max(limit, 0))
+    values = [
+        [_json_value(value, types[name]) for value in table.columns[name]]
+        for name in names
+    ]
+    rows = [dict(zip(names, row)) for row in zip(*values)]
+    return json.dumps({"matched": table.matched, "rows": rows})
+
+
+@app.function("aggregate")
+def aggregate(
+    metric: str, column: str = "", where: str = "", group_by: str = "", limit: int = 50
+):
+    """
+    count, sum, avg, min or max of a numeric column (count of rows without a
+    column) over the rows matching where, optionally per group of the
+    comma-separated group_by columns. Groups come largest value first.
+    """
+    types = column_types()
+    metric = metric.strip().lower()
+    try:
+        value_columns = csv_query.split_columns(column, types)
+        if len(value_columns) > 1:
+            raise csv_query.QueryError("Aggregate one column at a time.")
+        column = value_columns[0] if value_columns else None
+        if (
+            column
+            and metric != "count"
+            and types[column] not in csv_query.NUMERIC_TYPES
+        ):
+            raise csv_query.QueryError(f"'{column}' is not a numeric column.")
+        groups = csv_query.split_columns(group_by, types)
+        conditions = csv_query.parse_where(where, types)
+
+        # Only the grouping and aggregated columns are loaded, and only for
+        # the rows that match
+        loaded = list(dict.fromkeys(groups + ([column] if column else [])))
+        table = scan(types, conditions, *_by_type(loaded, types))
+        results = csv_query.aggregate(table, metric, column, groups)
+    except csv_query.QueryError as e:
+        raise ParameterError(str(e))
+
+    value_type = types[column] if column and metric != "avg" else "number"
+    results.sort(key=lambda item: (item[1] is None, -(item[1] or 0)))
+    output = []
+    for key, value in results[: max(limit, 1)]:
+        row = {name: _json_value(part, types[name]) for name, part in zip(groups, key)}
+        row[metric] = _json_value(value, value_type)
+        output.append(row)
+    return json.dumps(
+        {"matched": table.matched, "groups": len(results), "results": output}
+    )
+
+
+lambda_handler = app
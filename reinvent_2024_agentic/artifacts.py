@@ -0,0 +1,155 @@
+# Copies of this module are kept identical by sync_shared_modules.py at the
+# repository root: edit the first copy it lists, then run it.
+
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import threading
+from collections import OrderedDict
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Names given by content_name: 32 hex characters and an optional extension
+CONTENT_NAME_PATTERN = re.compile(r"[0-9a-f]{32}(\.\w+)?")
+
+
+def content_name(data, file_type):
+    """Name a file after a hash of its bytes, so identical outputs share one name."""
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    extension = mimetypes.guess_extension(file_type) or ""
+    return digest + extension
+
+
+def _reencode_png(data):
+    # Only needed when the bytes labelled image/png are not actually a PNG
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    buffer = io.BytesIO()
+    plt.imsave(buffer, plt.imread(io.BytesIO(data)), format="png")
+    return buffer.getvalue()
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for files emitted by the agent. Identical outputs,
+    from any turn or session, are stored once under the hash of their bytes.
+
+    Recently used artifacts are kept in an in-memory LRU of at most memory_bytes,
+    in front of a folder on disk holding at most disk_bytes (least recently used
+    files are deleted first). With folder=None the store is memory only. The
+    original bytes are stored as-is, with no decode/re-encode round trip.
+    """
+
+    def __init__(self, folder, memory_bytes=64 * 2**20, disk_bytes=1024 * 2**20):
+        self.folder = folder
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+            # Index what previous runs left behind, oldest first. Other files in
+            # the folder (e.g. .gitkeep, partial .tmp writes) are not artifacts
+            # and must never be evicted
+            entries = [
+                e
+                for e in os.scandir(folder)
+                if e.is_file() and CONTENT_NAME_PATTERN.fullmatch(e.name)
+            ]
+            for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+                self._disk[entry.path] = entry.stat().st_size
+                self._disk_size += entry.stat().st_size
+
+    def _key(self, name):
+        return name if self.folder is None else os.path.join(self.folder, name)
+
+    def put(self, data, file_type):
+        """Store the bytes and return their key, which is also their path on disk."""
+        if file_type == "image/png" and bytes(data[:8]) != PNG_SIGNATURE:
+            data = _reencode_png(data)
+
+        # bytes(data) is no copy when data already is bytes
+        data = bytes(data)
+        key = self._key(content_name(data, file_type))
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return key
+            self._remember(key, data)
+            if self.folder is None or key in self._disk:
+                return key
+
+        # Write to a temporary name first so readers never see a partial file
+        tmp_path = f"{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, key)
+
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = len(data)
+                self._disk_size += len(data)
+            self._evict_disk()
+        return key
+
+    def get(self, key):
+        """
+        Return the stored bytes (a bytes object, from memory or disk alike), or
+        None if the artifact has been evicted.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            if key not in self._disk:
+                return None
+            self._disk.move_to_end(key)
+
+        try:
+            with open(key, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            self._remember(key, data)
+        return data
+
+    def open(self, key):
+        """Return a binary file object for a stored artifact."""
+        data = self.get(key)
+        if data is None:
+            raise FileNotFoundError(key)
+        return io.BytesIO(data)
+
+    def __contains__(self, key):
+        return key in self._memory or key in self._disk
+
+    def _remember(self, key, data):
+        # Called with the lock held
+        if key in self._memory or len(data) > self.memory_bytes:
+            return
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _evict_disk(self):
+        # Called with the lock held
+        while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+            path, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,53 @@
+# Copies of this module are kept identical by sync_shared_modules.py at the
+# repository root: edit the first copy it lists, then run it.
+
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+# Shared by every client: pooled keep-alive connections, bounded connect time
+# and adaptive retries, which also back off client side when throttled
+DEFAULT_CONFIG = Config(
+    max_pool_connections=int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "32")),
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=60,
+    retries={"max_attempts": 5, "mode": "adaptive"},
+)
+
+# Per-service overrides, merged over DEFAULT_CONFIG
+SERVICE_CONFIGS = {
+    # Model calls and agent turns can stream for minutes
+    "bedrock-runtime": Config(read_timeout=300),
+    "bedrock-agent-runtime": Config(read_timeout=300),
+}
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+
+
+def get_client(service, region=None):
+    """
+    Return the shared boto3 client for a service and region, creating it on first
+    use. Clients are thread-safe and keep their connection pool, so callers should
+    use this instead of creating a client per call.
+    """
+    key = (service, region)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    # boto3 sessions are not thread-safe, so clients are created under the lock
+    global _session
+    with _lock:
+        if key not in _clients:
+            if _session is None:
+                _session = boto3.session.Session()
+            config = DEFAULT_CONFIG
+            if service in SERVICE_CONFIGS:
+                config = config.merge(SERVICE_CONFIGS[service])
+            _clients[key] = _session.client(service, region_name=region, config=config)
+        return _clients[key]
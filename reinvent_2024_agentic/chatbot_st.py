@@ -5,12 +5,22 @@ from datetime import datetime
 from io import BytesIO
 
 import agent_tools
-import boto3
+import aws_clients
+import history_view
+import session_ids
+import session_persistence
+import session_store
+import st_sink
 import streamlit as st
+from image_cache import is_s3_url
 from PIL import Image
 
-# Initialize S3 client
-s3_client = boto3.client("s3")
+# Seconds to wait for all images referenced in one response
+IMAGE_FETCH_TIMEOUT = 30
+
+# Per-session memory budget for the chat history, and where evicted messages go
+SESSION_BYTE_BUDGET = int(os.getenv("SESSION_BYTE_BUDGET", str(2 * 2**20)))
+SESSION_SPILL_DIR = os.getenv("SESSION_SPILL_DIR")
 
 # Sample questions
 SAMPLE_QUESTIONS = [
@@ -21,12 +31,44 @@ SAMPLE_QUESTIONS = [
 ]
 
 
+def new_session(resume_id=None):
+    """
+    Start a new conversation with an empty, bounded message store, or resume a
+    persisted one. The session id is kept in the URL so a reload, or another
+    replica, can pick the conversation up again.
+    """
+    if resume_id is not None and not session_ids.is_valid_session_id(resume_id):
+        # The id comes from the URL; anything else starts a new session
+        resume_id = None
+    writer = session_persistence.get_writer()
+    exists = writer.backend.session_exists if writer is not None else None
+    session_id = resume_id or session_ids.new_session_id(exists)
+    spill_path = None
+    if SESSION_SPILL_DIR:
+        spill_path = os.path.join(SESSION_SPILL_DIR, f"{session_id}.jsonl")
+
+    st.session_state.session_id = session_id
+    st.session_state.store = session_store.SessionStore(
+        byte_budget=SESSION_BYTE_BUDGET,
+        spill_path=spill_path,
+        artifact_store=agent_tools.artifact_store,
+        session_id=session_id,
+        writer=writer,
+    )
+    if resume_id and writer is not None:
+        # Writes still queued in this process must land before reading back
+        writer.flush()
+        st.session_state.store.restore(writer.backend.load_messages(resume_id))
+    st.session_state.history_cache = {}
+    st.query_params["session"] = session_id
+
+
 def upload_to_s3(file_bytes, file_name):
     """
     Upload a file to S3 and return the URL
     """
     try:
-        s3_client = boto3.client("s3")
+        s3_client = aws_clients.get_client("s3")
         bucket_name = os.getenv("S3_BUCKET_NAME")
 
         # Generate a unique file name to avoid collisions
@@ -51,30 +93,44 @@ def upload_to_s3(file_bytes, file_name):
         return None
 
 
-def extract_and_display_s3_images(text, s3_client):
+def extract_and_display_s3_images(text, image_cache=None):
     """
     Extract S3 URLs from text, download images, and return them for display
     """
+    image_cache = image_cache or agent_tools.image_cache
     s3_pattern = r"https://[\w\-\.]+\.s3\.amazonaws\.com/[\w\-\./]+"
     s3_urls = re.findall(s3_pattern, text)
 
+    # Download all images at once, failures are reported per URL
     images = []
-    for url in s3_urls:
-        try:
-            bucket = url.split(".s3.amazonaws.com/")[0].split("//")[1]
-            key = url.split(".s3.amazonaws.com/")[1]
+    results = image_cache.get_many(s3_urls, timeout=IMAGE_FETCH_TIMEOUT)
+    for result in results:
+        if isinstance(result, Exception):
+            st.error(f"Error downloading image from S3: {str(result)}")
+            continue
+        images.append(result)
 
-            response = s3_client.get_object(Bucket=bucket, Key=key)
-            image_data = response["Body"].read()
+    return images
 
-            image = Image.open(BytesIO(image_data))
-            images.append(image)
 
+def display_image(image, thumbnail=False):
+    """Display an image URL, a PIL image or an image from the artifact store"""
+    if is_s3_url(image):
+        # S3 images are served from the image cache, as thumbnails in the history
+        try:
+            st.image(agent_tools.download_image(image, thumbnail=thumbnail))
         except Exception as e:
             st.error(f"Error downloading image from S3: {str(e)}")
-            continue
-
-    return images
+    elif isinstance(image, str) and image.startswith("http"):
+        st.image(image)
+    elif isinstance(image, Image.Image):
+        st.image(image, use_column_width=True)
+    else:
+        image_data = agent_tools.artifact_store.get(image)
+        if image_data is None:
+            st.caption("Image no longer available")
+        else:
+            st.image(Image.open(BytesIO(image_data)), use_column_width=True)
 
 
 def process_query(prompt, uploaded_file=None):
@@ -90,7 +146,7 @@ def process_query(prompt, uploaded_file=None):
             prompt = f"{prompt}\nhere is the image: {image_url}"
 
     # Add user message to chat
-    st.session_state.messages.append(
+    st.session_state.store.append(
         {
             "role": "user",
             "content": [{"text": prompt}],
@@ -104,24 +160,35 @@ def process_query(prompt, uploaded_file=None):
     # Generate and display assistant response
     with st.chat_message("assistant"):
         trace_container = st.container()
+        message_placeholder = st.empty()
 
+        # Answer text is written to the placeholder as chunks stream in
         result = agent_tools.invoke_bedrock_agent(
-            prompt, st.session_state.session_id, trace_container
+            prompt,
+            st.session_state.session_id,
+            trace_container,
+            text_placeholder=message_placeholder,
         )
-
-        st.markdown(result["text"])
+        st.session_state.last_timing = result["timing"]
 
         if "images" in result:
+            # Download the response's S3 images at once, then display every
+            # image in order, S3 ones from what get_many returned
+            s3_urls = list(dict.fromkeys(i for i in result["images"] if is_s3_url(i)))
+            results = agent_tools.image_cache.get_many(
+                s3_urls, timeout=IMAGE_FETCH_TIMEOUT
+            )
+            fetched = dict(zip(s3_urls, results))
             for image in result["images"]:
-                if isinstance(image, str) and image.startswith("http"):
-                    st.image(image)
-                elif isinstance(image, Image.Image):
-                    st.image(image, use_column_width=True)
+                if not is_s3_url(image):
+                    display_image(image)
+                elif isinstance(fetched[image], Exception):
+                    # A failed or timed out download is not retried here
+                    st.caption(f"Image not available: {fetched[image]}")
                 else:
-                    image_data = Image.open(image)
-                    st.image(image_data, use_column_width=True)
+                    st.image(fetched[image])
 
-        st.session_state.messages.append(
+        st.session_state.store.append(
             {
                 "role": "assistant",
                 "content": [{"text": f"{result['text']}"}],
@@ -148,6 +215,7 @@ if uploaded_file is not None:
         st.rerun()
 
 clear_button = st.sidebar.button("Clear Conversation", key="clear")
+timing_placeholder = st.sidebar.empty()
 
 # Initialize session state for sample questions visibility
 if "show_sample_questions" not in st.session_state:
@@ -155,36 +223,21 @@ if "show_sample_questions" not in st.session_state:
 
 # Reset sessions state on clear
 if clear_button:
-    st.session_state.messages = []
-    st.session_state.session_id = agent_tools.generate_random_15digit()
+    new_session()
     st.session_state.show_sample_questions = (
         True  # Show sample questions again after clearing
     )
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-    st.session_state.session_id = agent_tools.generate_random_15digit()
+if "store" not in st.session_state:
+    new_session(st.query_params.get("session"))
 
 # Display chat messages
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        if "traces" in message:
-            trace_container = st.container()
-            for trace in message["traces"]:
-                with trace_container.expander(trace["trace_type"]):
-                    if trace["trace_type"] == "codeInterpreter":
-                        st.code(trace["text"], language="python")
-                    else:
-                        st.markdown(trace["text"])
-
-        message_text = message["content"][0]["text"]
-        st.markdown(message_text)
-
-        # Display images in the message
-        if "images" in message and message["images"]:
-            for image_url in message["images"]:
-                if image_url:  # Only display if image_url is not None
-                    st.image(image_url)
+history_view.render_history(
+    st.session_state.store.messages(),
+    st.session_state.session_id,
+    display_image,
+    start_index=st.session_state.store.evicted,
+)
 
 
 # Display sample questions in a 2x2 grid if they should be shown
@@ -215,3 +268,10 @@ if st.session_state.show_sample_questions:
 # Always show the chat input
 if user_input := st.chat_input("How can I help??"):
     process_query(user_input, uploaded_file)
+
+# Latency breakdown of the last turn, filled in once the turn has run
+if "last_timing" in st.session_state:
+    st_sink.render_waterfall(
+        st.session_state.last_timing,
+        timing_placeholder.container().expander("Last turn latency"),
+    )
@@ -0,0 +1,103 @@
+# Copies of this module are kept identical by sync_shared_modules.py at the
+# repository root: edit the first copy it lists, then run it.
+
+import asyncio
+import base64
+import json
+
+
+def _encode(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"__bytes__": base64.b64encode(bytes(value)).decode("ascii")}
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if "__bytes__" in value and len(value) == 1:
+            return base64.b64decode(value["__bytes__"])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+class ReplayEventStream:
+    """
+    Stands in for the botocore EventStream returned in response["completion"].
+    Iterating yields the recorded events in order; close() stops iteration early
+    the same way closing the real stream releases its connection.
+    """
+
+    def __init__(self, events):
+        self._events = list(events)
+        self.closed = False
+
+    def __iter__(self):
+        for event in self._events:
+            if self.closed:
+                return
+            yield event
+
+    def close(self):
+        self.closed = True
+
+    @classmethod
+    def from_jsonl(cls, path):
+        """Load a stream recorded with save_events (one event per line)."""
+        with open(path, "r") as f:
+            return cls(_decode(json.loads(line)) for line in f if line.strip())
+
+
+class AsyncReplayEventStream:
+    """
+    Async version of ReplayEventStream, standing in for the event stream of an
+    aioboto3 client. delay adds latency between events to simulate a slow agent.
+    """
+
+    def __init__(self, events, delay=0):
+        self._stream = ReplayEventStream(events)
+        self.delay = delay
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for event in self._stream:
+            # Always yield to the event loop, like a real network read
+            await asyncio.sleep(self.delay)
+            yield event
+
+    async def close(self):
+        self._stream.close()
+
+    @property
+    def closed(self):
+        return self._stream.closed
+
+
+class StubAgentClient:
+    """
+    Stubbed async bedrock-agent-runtime client. invoke_agent replays the same
+    recorded events for every call and keeps the call arguments in calls.
+    """
+
+    def __init__(self, events, delay=0):
+        self.events = list(events)
+        self.delay = delay
+        self.calls = []
+
+    async def invoke_agent(self, **kwargs):
+        self.calls.append(kwargs)
+        return {"completion": AsyncReplayEventStream(self.events, self.delay)}
+
+
+def save_events(events, path):
+    """Record completion events to a JSON lines file, base64 encoding any bytes."""
+    with open(path, "w") as f:
+        for event in events:
+            f.write(json.dumps(_encode(event)) + "\n")
@@ -0,0 +1,83 @@
+# Copies of this module are kept identical by sync_shared_modules.py at the
+# repository root: edit the first copy it lists, then run it.
+
+import streamlit as st
+
+# Messages at the end of the conversation that are shown with all their traces
+RECENT_MESSAGES = 4
+
+# st.toggle and st.fragment are only in newer Streamlit releases
+_toggle = getattr(st, "toggle", st.checkbox)
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+
+
+def _trace_summary(traces):
+    counts = {}
+    for trace in traces:
+        counts[trace["trace_type"]] = counts.get(trace["trace_type"], 0) + 1
+    parts = ", ".join(f"{name} x{count}" for name, count in counts.items())
+    return f"Show {len(traces)} traces ({parts})"
+
+
+def _render_trace(trace):
+    with st.expander(trace["trace_type"]):
+        if trace.get("is_error"):
+            st.error(trace["text"])
+        elif trace["trace_type"] == "codeInterpreter":
+            st.code(trace["text"], language="python")
+        elif trace["trace_type"] == "knowledgeBaseLookupOutput":
+            for reference in trace["text"]:
+                st.markdown(reference["location"]["s3Location"]["uri"])
+                st.markdown(reference["content"]["text"])
+        else:
+            st.markdown(trace["text"])
+
+
+def _collapsed_traces(key, summary, traces):
+    # Trace bodies of older messages are only rendered when asked for
+    if _toggle(summary, key=key):
+        for trace in traces:
+            _render_trace(trace)
+
+
+if _fragment is not None:
+    # Toggling then reruns just this fragment instead of the whole script
+    _collapsed_traces = _fragment(_collapsed_traces)
+
+
+def render_history(
+    messages, key_prefix, display_image=None, recent=RECENT_MESSAGES, start_index=0
+):
+    """
+    Render the chat history. The last `recent` messages are shown in full; older
+    messages get a single toggle summarizing their traces, so the cost of a rerun
+    stays flat as the conversation grows. Summaries are computed once per message
+    and cached in the session state under key_prefix. start_index is the position
+    of the first message in the conversation, if earlier ones were evicted.
+    """
+    cache = st.session_state.setdefault("history_cache", {})
+    first_recent = len(messages) - recent
+
+    if start_index:
+        st.caption(f"{start_index} earlier messages are not shown")
+
+    for index, message in enumerate(messages):
+        key = f"{key_prefix}-{start_index + index}"
+        older = index < first_recent
+
+        with st.chat_message(message["role"]):
+            traces = message.get("traces") or []
+            if traces and older:
+                if key not in cache:
+                    cache[key] = _trace_summary(traces)
+                _collapsed_traces(f"traces-{key}", cache[key], traces)
+            else:
+                for trace in traces:
+                    _render_trace(trace)
+
+            st.markdown(message["content"][0]["text"])
+
+            if display_image is not None:
+                for image in message.get("images") or []:
+                    if image:  # Only display if image is not None
+                        display_image(image, thumbnail=older)
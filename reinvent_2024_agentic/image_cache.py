@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from botocore.exceptions import ClientError
+from PIL import Image
+
+# Size used for images in the chat history
+THUMBNAIL_SIZE = (512, 512)
+
+
+def parse_s3_url(url):
+    """Split a https://<bucket>.s3.amazonaws.com/<key> URL into bucket and key."""
+    bucket = url.split(".s3.amazonaws.com/")[0].split("//")[1]
+    key = url.split(".s3.amazonaws.com/")[1]
+    return bucket, key
+
+
+def is_s3_url(url):
+    return isinstance(url, str) and ".s3.amazonaws.com/" in url
+
+
+def _not_modified(error):
+    status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    code = error.response.get("Error", {}).get("Code")
+    return status == 304 or code in ("304", "NotModified")
+
+
+class CachedImage:
+    """Downloaded image bytes. Decoding into PIL happens only when first needed."""
+
+    __slots__ = ("etag", "data", "fetched_at", "image", "thumbnails")
+
+    def __init__(self, etag, data, fetched_at):
+        self.etag = etag
+        self.data = data
+        self.fetched_at = fetched_at
+        self.image = None
+        self.thumbnails = {}
+
+
+class S3ImageCache:
+    """
+    Bounded cache of images downloaded from S3, so Streamlit reruns don't fetch
+    and decode the same diagram again. Entries are fresh for ttl seconds; after
+    that the object is revalidated with a conditional GET on its ETag, which
+    costs no download when the object is unchanged.
+    """
+
+    def __init__(self, s3_client, max_entries=128, ttl=300, max_workers=8):
+        self.s3_client = s3_client
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Shares the client (and its connection pool) across fetch threads
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="s3-image"
+        )
+
+    def get(self, url):
+        """Return the CachedImage for an S3 URL, downloading it if needed."""
+        bucket, key = parse_s3_url(url)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get((bucket, key))
+            if entry is not None:
+                self._entries.move_to_end((bucket, key))
+                if now - entry.fetched_at < self.ttl:
+                    return entry
+
+        if entry is not None and entry.etag:
+            try:
+                response = self.s3_client.get_object(
+                    Bucket=bucket, Key=key, IfNoneMatch=entry.etag
+                )
+            except ClientError as e:
+                if not _not_modified(e):
+                    raise
+                entry.fetched_at = now
+                return entry
+        else:
+            response = self.s3_client.get_object(Bucket=bucket, Key=key)
+
+        entry = CachedImage(response.get("ETag"), response["Body"].read(), now)
+        with self._lock:
+            self._entries[(bucket, key)] = entry
+            self._entries.move_to_end((bucket, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get_bytes(self, url):
+        return self.get(url).data
+
+    def _decode(self, entry):
+        # Decoded outside the lock so the fetch threads decode in parallel. Two
+        # threads may both decode the same entry, the first result is kept.
+        if entry.image is None:
+            image = Image.open(BytesIO(entry.data))
+            image.load()
+            with self._lock:
+                if entry.image is None:
+                    entry.image = image
+        return entry.image
+
+    def get_image(self, url):
+        """Return the decoded PIL image, decoding it on first use."""
+        return self._decode(self.get(url))
+
+    def get_thumbnail(self, url, size=THUMBNAIL_SIZE):
+        """Return a downscaled copy of the image, e.g. for the chat history."""
+        entry = self.get(url)
+        thumbnail = entry.thumbnails.get(size)
+        if thumbnail is None:
+            thumbnail = self._decode(entry).copy()
+            thumbnail.thumbnail(size)
+            with self._lock:
+                thumbnail = entry.thumbnails.setdefault(size, thumbnail)
+        return thumbnail
+
+    def get_many(self, urls, timeout=None, decode=True):
+        """
+        Fetch several S3 URLs concurrently, so the total latency is close to the
+        slowest single object. Returns one result per URL, in order: the PIL image
+        (the CachedImage if decode is False), or the exception raised for that URL.
+        timeout, in seconds, bounds the whole call rather than each request: URLs
+        still pending when it expires get a TimeoutError. Each request is bounded
+        by the S3 client's own connect and read timeouts.
+        """
+        fetch = self.get_image if decode else self.get
+        futures = [self._executor.submit(fetch, url) for url in urls]
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        results = []
+        for future in futures:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+            try:
+                results.append(future.result(timeout=remaining))
+            except Exception as e:
+                future.cancel()
+                results.append(e)
+        return results
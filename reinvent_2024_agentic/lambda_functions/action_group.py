@@ -0,0 +1,312 @@
+"""
+Small framework for Bedrock agent action group Lambdas (function details).
+
+    app = ActionGroupApp()
+
+    @app.function("describe_image", cache_ttl=300)
+    def describe_image(image_url: str):
+        return "..."
+
+    lambda_handler = app
+
+Functions are routed on the event's "function" name. Their parameters are
+filled from the event parameters by name and converted to the annotated type
+(str, int, float, bool, list or dict); a parameter named `event` receives the
+parsed ActionGroupEvent. Several functions, or the apps of several modules via
+include(), can share one Lambda and so one warm container.
+
+Every call goes through the middleware (error mapping, timing and caching by
+default); a middleware is a callable (request, call_next) -> result.
+
+Copies of this module are kept identical by sync_shared_modules.py at the
+repository root: edit the first copy it lists, then run it.
+"""
+
+import inspect
+import json
+import threading
+import time
+
+import agent_logging
+
+logger = agent_logging.get_logger(__name__)
+
+
+class ActionGroupError(Exception):
+    """
+    An error reported back to the agent as the function's result. With
+    response_state "REPROMPT" the model is asked to try again, with "FAILURE"
+    the agent stops the turn.
+    """
+
+    def __init__(self, message, response_state=None):
+        super().__init__(message)
+        self.response_state = response_state
+
+
+class ParameterError(ActionGroupError):
+    """A missing or malformed parameter; the model is reprompted to fix it."""
+
+    def __init__(self, message):
+        super().__init__(message, "REPROMPT")
+
+
+class ActionGroupEvent:
+    """The parts of an action group Lambda event the functions use."""
+
+    __slots__ = (
+        "message_version",
+        "action_group",
+        "function",
+        "parameters",
+        "input_text",
+        "session_id",
+        "session_attributes",
+        "prompt_session_attributes",
+        "raw",
+    )
+
+    def __init__(self, event):
+        self.message_version = event.get("messageVersion", "1.0")
+        self.action_group = event.get("actionGroup", "")
+        self.function = event.get("function", "")
+        # Parameters arrive as [{"name", "type", "value"}] with string values
+        self.parameters = {
+            p["name"]: p.get("value") for p in event.get("parameters") or []
+        }
+        self.input_text = event.get("inputText", "")
+        self.session_id = event.get("sessionId")
+        self.session_attributes = event.get("sessionAttributes") or {}
+        self.prompt_session_attributes = event.get("promptSessionAttributes") or {}
+        self.raw = event
+
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in ("true", "1", "yes"):
+        return True
+    if str(value).strip().lower() in ("false", "0", "no"):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+
+def _to_json(expected):
+    def convert(value):
+        if isinstance(value, expected):
+            return value
+        parsed = json.loads(value)
+        if not isinstance(parsed, expected):
+            raise ValueError(f"not a {expected.__name__}: {value!r}")
+        return parsed
+
+    return convert
+
+
+# Converters from the string values in the event to the annotated types
+CONVERTERS = {
+    str: str,
+    int: int,
+    float: float,
+    bool: _to_bool,
+    list: _to_json(list),
+    dict: _to_json(dict),
+}
+
+
+class Route:
+    """A registered function with its parameter converters, built once."""
+
+    def __init__(self, name, func, cache_ttl=None):
+        self.name = name
+        self.func = func
+        self.cache_ttl = cache_ttl
+        self.wants_event = False
+        # (name, converter, required, default) per parameter
+        self.params = []
+        for param in inspect.signature(func).parameters.values():
+            if param.name == "event":
+                self.wants_event = True
+                continue
+            annotation = param.annotation
+            converter = CONVERTERS.get(annotation, str)
+            required = param.default is inspect.Parameter.empty
+            self.params.append((param.name, converter, required, param.default))
+
+    def bind(self, event):
+        """Return the keyword arguments for the function, converted to their types."""
+        values = event.parameters
+        # Single-parameter tools also accept their one parameter under another
+        # name, as these Lambdas used to read parameters[0] whatever it was called
+        if len(self.params) == 1 and len(values) == 1:
+            values = {self.params[0][0]: next(iter(values.values()))}
+
+        kwargs = {}
+        for name, converter, required, default in self.params:
+            if name not in values:
+                if required:
+                    raise ParameterError(f"Missing required parameter '{name}'.")
+                kwargs[name] = default
+                continue
+            try:
+                kwargs[name] = converter(values[name])
+            except (TypeError, ValueError) as e:
+                raise ParameterError(f"Invalid value for parameter '{name}': {e}")
+        if self.wants_event:
+            kwargs["event"] = event
+        return kwargs
+
+
+class Request:
+    """One function call passing through the middleware."""
+
+    __slots__ = ("event", "route", "kwargs")
+
+    def __init__(self, event, route, kwargs):
+        self.event = event
+        self.route = route
+        self.kwargs = kwargs
+
+
+def error_middleware(request, call_next):
+    """Turn exceptions into results the agent can read instead of a failed Lambda."""
+    try:
+        return call_next(request)
+    except ActionGroupError:
+        raise
+    except Exception as e:
+        logger.exception("Error in %s", request.route.name)
+        raise ActionGroupError(f"Error running {request.route.name}: {e}", "FAILURE")
+
+
+def timing_middleware(request, call_next):
+    start = time.perf_counter()
+    try:
+        return call_next(request)
+    finally:
+        logger.info(
+            "%s took %.1f ms",
+            request.route.name,
+            (time.perf_counter() - start) * 1000,
+        )
+
+
+class CacheMiddleware:
+    """
+    Caches results of functions registered with a cache_ttl, keyed on the
+    function and its arguments, for as long as the container stays warm.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def __call__(self, request, call_next):
+        ttl = request.route.cache_ttl
+        if not ttl:
+            return call_next(request)
+
+        arguments = {k: v for k, v in request.kwargs.items() if k != "event"}
+        if request.route.wants_event:
+            # The function may use the user's request as well as its parameters
+            arguments["event.input_text"] = request.event.input_text
+        key = (request.route.name, json.dumps(arguments, sort_keys=True, default=str))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < ttl:
+                logger.debug("Cache hit for %s", request.route.name)
+                return entry[1]
+
+        result = call_next(request)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                # Drop the oldest entry; dicts keep insertion order
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (now, result)
+        return result
+
+
+def build_response(event, body, response_state=None):
+    """Build the function response the agent expects from an action group Lambda."""
+    function_response = {"responseBody": {"TEXT": {"body": str(body)}}}
+    if response_state:
+        function_response["responseState"] = response_state
+    return {
+        "messageVersion": event.message_version,
+        "response": {
+            "actionGroup": event.action_group,
+            "function": event.function,
+            "functionResponse": function_response,
+        },
+        "sessionAttributes": event.session_attributes,
+        "promptSessionAttributes": event.prompt_session_attributes,
+    }
+
+
+class ActionGroupApp:
+    """Routes action group events to registered functions; use it as the handler."""
+
+    def __init__(self, middleware=None):
+        self.routes = {}
+        self.default_route = None
+        if middleware is None:
+            middleware = [error_middleware, timing_middleware, CacheMiddleware()]
+        self.middleware = list(middleware)
+
+    def function(self, name=None, cache_ttl=None, default=False):
+        """
+        Register a function under name (the Python name by default). With
+        default=True it also handles events whose function name is not
+        registered, as single-tool Lambdas did before routing existed.
+        """
+
+        def decorator(func):
+            route = Route(name or func.__name__, func, cache_ttl)
+            self.routes[route.name] = route
+            if default:
+                self.default_route = route
+            return func
+
+        return decorator
+
+    def include(self, other):
+        """Serve the named functions of another app from this one."""
+        self.routes.update(other.routes)
+
+    def _call(self, request):
+        # Run the middleware in order, the function itself last
+        def call_next_at(index):
+            def call_next(request):
+                if index == len(self.middleware):
+                    return request.route.func(**request.kwargs)
+                return self.middleware[index](request, call_next_at(index + 1))
+
+            return call_next
+
+        return call_next_at(0)(request)
+
+    def __call__(self, event, context=None):
+        # Log the received event, tagged with the agent session id
+        agent_logging.set_session_id(event.get("sessionId"))
+        agent_logging.log_event(logger, "request", event)
+
+        parsed = ActionGroupEvent(event)
+        route = self.routes.get(parsed.function, self.default_route)
+        try:
+            if route is None:
+                raise ActionGroupError(
+                    f"Unknown function '{parsed.function}'.", "REPROMPT"
+                )
+            result = self._call(Request(parsed, route, route.bind(parsed)))
+            response = build_response(parsed, result)
+        except ActionGroupError as e:
+            response = build_response(parsed, str(e), e.response_state)
+
+        # Log the response body
+        logger.debug(
+            "Response body: %s",
+            agent_logging.Truncated(response["response"]["functionResponse"]),
+        )
+        return response
@@ -0,0 +1,11 @@
+import describe_image
+import website_to_text
+from action_group import ActionGroupApp
+
+# One Lambda serving several tools, so they share a warm container. The action
+# group's function names must match the registered names here.
+app = ActionGroupApp()
+app.include(describe_image.app)
+app.include(website_to_text.app)
+
+lambda_handler = app
@@ -0,0 +1,38 @@
+"""
+Cold start helpers for the Lambda handlers.
+
+COLD_START_MODE selects what is done during the INIT phase:
+
+- "lazy" (default): heavy modules such as PIL and requests are imported on
+  first use, so a cold start only pays for what the invoked path needs.
+- "eager": everything registered with at_init runs at import, for provisioned
+  concurrency or SnapStart where INIT is not on the request path. Only work
+  that opens no connection and does not depend on the request is registered,
+  so it is safe to capture in a snapshot.
+
+See cold_start_benchmark.py for an import-time profile of the handlers.
+
+Copies of this module are kept identical by sync_shared_modules.py at the
+repository root: edit the first copy it lists, then run it.
+"""
+
+import importlib
+import os
+import sys
+
+EAGER = os.getenv("COLD_START_MODE", "lazy").lower() == "eager"
+
+
+def lazy_import(name):
+    """Import a module on first use; later calls are a sys.modules lookup."""
+    module = sys.modules.get(name)
+    if module is None:
+        module = importlib.import_module(name)
+    return module
+
+
+def at_init(func):
+    """Decorator: in eager mode, also call func during INIT. func is returned as is."""
+    if EAGER:
+        func()
+    return func
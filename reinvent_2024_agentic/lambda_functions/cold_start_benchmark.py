@@ -0,0 +1,208 @@
+"""
+Local cold start benchmark for the Lambda handlers.
+
+For each handler and COLD_START_MODE it reports the INIT cost (importing the
+handler in a fresh interpreter, with the slowest imports from -X importtime)
+and, where the handler can run against stub AWS clients, the latency of the
+first (cold) invocation against the median of the following (warm) ones.
+
+    python cold_start_benchmark.py
+    python cold_start_benchmark.py --handler describe_image --warm 20
+"""
+
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Module name and directory of each handler
+HANDLERS = {
+    "describe_image": HERE,
+    "website_to_text": HERE,
+    "create_lambda_functions": HERE,
+    # Invoking it needs graphviz and diagrams, so only its INIT is measured
+    "lambda_handler": os.path.join(HERE, "gen_aws_diag_docker"),
+}
+
+# Handlers that run end to end against the stubs below
+INVOCABLE = ["describe_image", "website_to_text", "create_lambda_functions"]
+
+# Dummy settings some handlers read at import
+ENV = {"LAMBDA_ROLE": "benchmark", "S3_BUCKET": "benchmark", "AWS_REGION": "us-west-2"}
+
+PNG_BYTES = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010802000000907753de"
+    "0000000c4944415478da63f8cfc000000301010000c9fe92ef0000000049454e44ae426082"
+)
+
+
+class StubAWSClient:
+    """Answers the calls the handlers make with canned responses, no network."""
+
+    def invoke_model(self, **kwargs):
+        body = {"content": [{"text": "A stub description."}]}
+        return {"body": io.BytesIO(json.dumps(body).encode())}
+
+    def converse(self, **kwargs):
+        message = {"role": "assistant", "content": [{"text": "No tool needed."}]}
+        return {"output": {"message": message}}
+
+    def get_object(self, **kwargs):
+        return {"Body": io.BytesIO(PNG_BYTES), "ContentType": "image/png"}
+
+    def put_object(self, **kwargs):
+        return {}
+
+
+def _stub_send(adapter, request, **kwargs):
+    # Replaces HTTPAdapter.send: the session, its adapters and the request are
+    # real, only the network round trip is skipped
+    import requests
+
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b"Stub website text."
+    response.encoding = "utf-8"
+    response.url = request.url
+    response.request = request
+    return response
+
+
+def _stub_transport(lazy_import):
+    """
+    Wrap cold_start.lazy_import so that requests, when a handler imports it,
+    gets the stub transport. The import itself still happens on first use.
+    """
+
+    def wrapper(name):
+        module = lazy_import(name)
+        if name == "requests":
+            module.adapters.HTTPAdapter.send = _stub_send
+        return module
+
+    return wrapper
+
+
+def _event(value):
+    return {
+        "messageVersion": "1.0",
+        "actionGroup": "benchmark",
+        "function": "benchmark",
+        "inputText": "Describe this.",
+        "parameters": [{"name": "url", "type": "string", "value": value}],
+    }
+
+
+def _measure_invocations(name, warm):
+    # Runs in the child interpreter: stub the shared clients, then time the calls
+    import aws_clients
+    import cold_start
+
+    stub = StubAWSClient()
+    for service in ["s3", "bedrock-runtime", "lambda"]:
+        for region in [None, "us-west-2"]:
+            aws_clients._clients[(service, region)] = stub
+    cold_start.lazy_import = _stub_transport(cold_start.lazy_import)
+
+    module = __import__(name)
+
+    timings = []
+    for i in range(warm + 1):
+        # A new URL each time: describe_image and website_to_text cache their
+        # results, and a cache hit would not measure the handler
+        event = _event(f"https://bucket.s3.amazonaws.com/diagram-{i}.png")
+        start = time.perf_counter()
+        module.lambda_handler(event, None)
+        timings.append(time.perf_counter() - start)
+    print(json.dumps({"cold": timings[0], "warm": timings[1:]}))
+
+
+def _child(code, name, mode):
+    env = dict(os.environ, COLD_START_MODE=mode, LOG_LEVEL="WARNING", **ENV)
+    paths = [HANDLERS[name], HERE, os.environ.get("PYTHONPATH", "")]
+    env["PYTHONPATH"] = os.pathsep.join(path for path in paths if path)
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=HANDLERS[name],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+
+
+def import_profile(name, mode, top=5):
+    """
+    Return the time to import a handler (its INIT) in a fresh interpreter, and
+    its slowest direct imports, from the -X importtime report.
+    """
+    result = _child(f"import {name}", name, mode)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    # Lines look like "import time: self [us] | cumulative | <indent>package",
+    # with two spaces of indent per level and children printed before parents
+    children, total, direct = [], 0, []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, package = line[len("import time:") :].split("|")
+        level = (len(package) - len(package.lstrip()) - 1) // 2
+        if level == 1:
+            children.append((int(cumulative), package.strip()))
+        elif level == 0:
+            if package.strip() == name:
+                total, direct = int(cumulative), children
+            children = []
+    direct.sort(reverse=True)
+    return total / 1e6, direct[:top]
+
+
+def invocation_latency(name, mode, warm):
+    code = f"import cold_start_benchmark as b; b._measure_invocations({name!r}, {warm})"
+    result = _child(code, name, mode)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--handler", choices=sorted(HANDLERS), action="append")
+    parser.add_argument("--mode", choices=["lazy", "eager"], action="append")
+    parser.add_argument("--warm", type=int, default=10, help="warm invocations")
+    args = parser.parse_args()
+
+    for name in args.handler or list(HANDLERS):
+        for mode in args.mode or ["lazy", "eager"]:
+            print(f"{name} ({mode})")
+            try:
+                init, imports = import_profile(name, mode)
+            except RuntimeError as e:
+                print(f"  import failed: {e}")
+                continue
+            print(f"  import (INIT):        {init * 1000:8.1f} ms")
+            for cumulative, package in imports:
+                print(f"    {package:<30} {cumulative / 1000:8.1f} ms")
+
+            if name not in INVOCABLE:
+                continue
+            try:
+                latency = invocation_latency(name, mode, args.warm)
+            except RuntimeError as e:
+                print(f"  invocation failed: {e}")
+                continue
+            print(f"  cold invocation:      {latency['cold'] * 1000:8.1f} ms")
+            print(
+                f"  warm invocation p50:  "
+                f"{statistics.median(latency['warm']) * 1000:8.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
-import json
-import math
 import os
 import shutil
 import subprocess
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
-import boto3
+import agent_logging
+import aws_clients
+import cold_start
+import converse_stream
+from action_group import ActionGroupApp
 from botocore.exceptions import ClientError
 
 # Retrieve environment variables
@@ -14,13 +17,21 @@ LAMBDA_ROLE = os.environ["LAMBDA_ROLE"]
 S3_BUCKET = os.environ["S3_BUCKET"]
 REGION = "us-west-2"
 
+# Stream responses with converse_stream, so the deployment package is built
+# while the model finishes its response. Needs the
+# bedrock:InvokeModelWithResponseStream permission on top of bedrock:InvokeModel.
+CONVERSE_STREAM = os.getenv("CONVERSE_STREAM", "false").lower() == "true"
 
+logger = agent_logging.get_logger(__name__)
+
+
+# Creating clients opens no connection, so it is safe during INIT
+@cold_start.at_init
 def initialize_clients():
-    """Initialize and return the AWS Bedrock, Lambda, and S3 clients."""
-    session = boto3.Session()
-    bedrock = session.client(service_name="bedrock-runtime", region_name=REGION)
-    lambda_client = session.client("lambda", region_name=REGION)
-    s3 = session.client("s3", region_name=REGION)
+    """Return the shared AWS Bedrock, Lambda, and S3 clients."""
+    bedrock = aws_clients.get_client("bedrock-runtime", REGION)
+    lambda_client = aws_clients.get_client("lambda", REGION)
+    s3 = aws_clients.get_client("s3", REGION)
     return bedrock, lambda_client, s3
 
 
@@ -176,14 +187,54 @@ def get_tool_list():
     ]
 
 
-def query_llm(bedrock, messages, tools, system_prompt):
-    """Make a request to the LLM and return the response."""
-    return bedrock.converse(
-        modelId="anthropic.claude-3-5-sonnet-20241022-v2:0",
-        messages=messages,
-        inferenceConfig={"maxTokens": 2000, "temperature": 0.7},
-        toolConfig={"tools": tools},
-        system=[{"text": system_prompt}],
+def query_llm(
+    bedrock,
+    messages,
+    tools,
+    system_prompt,
+    stream=False,
+    on_text=None,
+    on_tool_use=None,
+):
+    """
+    Make a request to the LLM and return the response. With stream=True it is
+    streamed with converse_stream: on_text receives the text deltas and
+    on_tool_use each toolUse block as soon as it is complete, and the response
+    has the same shape as with converse.
+    """
+    request = {
+        "modelId": "anthropic.claude-3-5-sonnet-20241022-v2:0",
+        "messages": messages,
+        "inferenceConfig": {"maxTokens": 2000, "temperature": 0.7},
+        "toolConfig": {"tools": tools},
+        "system": [{"text": system_prompt}],
+    }
+    if not stream:
+        return bedrock.converse(**request)
+    response = bedrock.converse_stream(**request)
+    return converse_stream.collect(response["stream"], on_text, on_tool_use)
+
+
+def package_lambda_function(
+    code,
+    function_name,
+    has_external_python_libraries,
+    external_python_libraries,
+    build_id=None,
+    **_,
+):
+    """
+    Build the deployment package of a Lambda function and return its path.
+    build_id (e.g. the toolUseId) keeps the working directory and zip of
+    packages built at the same time apart, even for the same function name.
+    """
+    project_name = function_name if build_id is None else f"{function_name}_{build_id}"
+    if has_external_python_libraries:
+        return create_deployment_package_with_dependencies(
+            code, project_name, f"{project_name}.zip", external_python_libraries
+        )
+    return create_deployment_package_no_dependencies(
+        code, project_name, f"{project_name}.zip"
     )
 
 
@@ -195,30 +246,31 @@ def create_lambda_function(
     description: str,
     has_external_python_libraries: bool,
     external_python_libraries: List[str],
+    zipfile=None,
 ) -> str:
     """
     Creates and deploys a Lambda Function, based on what the customer requested.
-    Returns the name of the created Lambda function
+    Returns the name of the created Lambda function. zipfile is the deployment
+    package when it was already built while the response streamed.
     """
-    print("Creating Lambda function")
+    logger.info("Creating Lambda function")
     runtime = "python3.13"
     handler = "lambda_function.lambda_handler"
 
     # Create a zip file for the code
-    if has_external_python_libraries:
-        zipfile = create_deployment_package_with_dependencies(
-            code, function_name, f"{function_name}.zip", external_python_libraries
-        )
-    else:
-        zipfile = create_deployment_package_no_dependencies(
-            code, function_name, f"{function_name}.zip"
+    if zipfile is None:
+        zipfile = package_lambda_function(
+            code,
+            function_name,
+            has_external_python_libraries,
+            external_python_libraries,
         )
 
     try:
         # Upload zip file
         zip_key = f"lambda_resources/{function_name}.zip"
         s3.upload_file(zipfile, S3_BUCKET, zip_key)
-        print(f"Uploaded zip to {S3_BUCKET}/{zip_key}")
+        logger.info("Uploaded zip to %s/%s", S3_BUCKET, zip_key)
 
         response = lambda_client.create_function(
             Code={
@@ -233,18 +285,22 @@ def create_lambda_function(
             Role=LAMBDA_ROLE,
             Runtime=runtime,
         )
-        print("Lambda function created successfully")
-        print(response)
+        logger.info("Lambda function created successfully")
+        logger.debug("%s", agent_logging.Truncated(response))
         deployed_function = response["FunctionName"]
         user_response = f"The function {deployed_function} has been deployed to the customer's AWS account. I will now provide my final answer to the customer on how to invoke the {deployed_function} function with boto3 and print the result."
         return user_response
     except ClientError as e:
-        print(e)
+        logger.error(e)
         return f"Error: {e}\n Let me try again..."
 
 
-def process_llm_response(response_message, lambda_client, s3):
-    """Process the LLM's response, handling tool usage and text output."""
+def process_llm_response(response_message, lambda_client, s3, packages=None):
+    """
+    Process the LLM's response, handling tool usage and text output. packages
+    maps toolUseIds to the futures of deployment packages started early.
+    """
+    packages = packages or {}
     response_content_blocks = response_message["content"]
     follow_up_content_blocks = []
     # llm_response = ""
@@ -253,8 +309,9 @@ def process_llm_response(response_message, lambda_client, s3):
         if "toolUse" in content_block:
             tool_use_block = content_block["toolUse"]
             tool_use_name = tool_use_block["name"]
-            print(f"Using tool {tool_use_name}")
+            logger.info("Using tool %s", tool_use_name)
             if tool_use_name == "create_lambda_function":
+                package = packages.get(tool_use_block["toolUseId"])
                 result = create_lambda_function(
                     lambda_client,
                     s3,
@@ -263,8 +320,9 @@ def process_llm_response(response_message, lambda_client, s3):
                     tool_use_block["input"]["description"],
                     tool_use_block["input"]["has_external_python_libraries"],
                     tool_use_block["input"]["external_python_libraries"],
+                    zipfile=package.result() if package is not None else None,
                 )
-                print(f"Lambda function creation result: {result}")
+                logger.info("Lambda function creation result: %s", result)
                 # llm_response = result
                 follow_up_content_blocks.append(
                     {
@@ -275,7 +333,9 @@ def process_llm_response(response_message, lambda_client, s3):
                     }
                 )
         elif "text" in content_block:
-            print(f"LLM response: {content_block['text']}")
+            logger.debug(
+                "LLM response: %s", agent_logging.Truncated(content_block["text"])
+            )
 
             # llm_response = content_block["text"]
 
@@ -300,71 +360,71 @@ def lambda_function_pipeline(input_text):
     # Set the system prompt
     system_prompt = "You are an AI assistant capable of creating Python Lambda functions. Use the provided tools when necessary."
 
-    # Make the initial request to the LLM
-    response = query_llm(bedrock, message_list, tool_list, system_prompt)
-    response_message = response["output"]["message"]
-    print(json.dumps(response_message, indent=4))
-    message_list.append(response_message)
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="package") as pool:
+        packages = {}
+
+        def on_tool_use(tool_use_block):
+            # The function's code is complete once its toolUse block closes, so
+            # packaging starts while the model is still streaming the response
+            if tool_use_block["name"] == "create_lambda_function":
+                packages[tool_use_block["toolUseId"]] = pool.submit(
+                    package_lambda_function,
+                    build_id=tool_use_block["toolUseId"],
+                    **tool_use_block["input"],
+                )
+
+        # Make the initial request to the LLM
+        response = query_llm(
+            bedrock,
+            message_list,
+            tool_list,
+            system_prompt,
+            stream=CONVERSE_STREAM,
+            on_tool_use=on_tool_use,
+        )
+        response_message = response["output"]["message"]
+        logger.debug("LLM message: %s", agent_logging.Truncated(response_message))
+        message_list.append(response_message)
 
-    # Process the LLM's response
-    follow_up_content_blocks = process_llm_response(response_message, lambda_client, s3)
-    print("THIS IS FOLLOW UP CONTEXT")
-    print(follow_up_content_blocks)
+        # Process the LLM's response, using the packages built while it streamed
+        follow_up_content_blocks = process_llm_response(
+            response_message, lambda_client, s3, packages
+        )
+    logger.debug(
+        "Follow up content: %s", agent_logging.Truncated(follow_up_content_blocks)
+    )
 
     # If there are follow-up content blocks, make another request to the LLM
     if follow_up_content_blocks:
-        print("MAKING FOLLOW UP REQUEST")
+        logger.debug("Making follow up request")
         follow_up_message = {
             "role": "user",
             "content": follow_up_content_blocks,
         }
         message_list.append(follow_up_message)
 
-        response = query_llm(bedrock, message_list, tool_list, system_prompt)
+        response = query_llm(
+            bedrock, message_list, tool_list, system_prompt, stream=CONVERSE_STREAM
+        )
         response_message = response["output"]["message"]
-        print(json.dumps(response_message, indent=4))
+        logger.debug("LLM message: %s", agent_logging.Truncated(response_message))
         message_list.append(response_message)
 
         # Process the final response
         follow_up_content_blocks = process_llm_response(
             response_message, lambda_client, s3
         )
-    print("THIS IS MESSAGE LIST")
-    print(message_list)
+    logger.debug("Message list: %s", agent_logging.Truncated(message_list))
     return message_list
 
 
-def lambda_handler(event, context):
-    # Print the received event to the logs
-    print("Received event: ")
-    print(event)
-
-    # Initialize response code to None
-
-    # Extract the action group, api path, and parameters from the prediction
-    actionGroup = event["actionGroup"]
-    function = event.get("function", "")
-    parameters = event.get("parameters", [])
-    inputText = event.get("inputText", "")
-
-    results = lambda_function_pipeline(inputText)
+app = ActionGroupApp()
 
-    response_body = {"TEXT": {"body": str(results)}}
 
-    # Print the response body to the logs
-    print(f"Response body: {response_body}")
+@app.function("create_lambda_function", default=True)
+def create_lambda_function_request(event):
+    """Create and deploy the Lambda function described in the user's request."""
+    return str(lambda_function_pipeline(event.input_text))
 
-    # Create a dictionary containing the response details
-    action_response = {
-        "actionGroup": actionGroup,
-        "function": function,
-        "functionResponse": {"responseBody": response_body},
-    }
-
-    # Return the list of responses as a dictionary
-    api_response = {
-        "messageVersion": event["messageVersion"],
-        "response": action_response,
-    }
 
-    return api_response
+lambda_handler = app
@@ -1,17 +1,39 @@
 import base64
 import io
 import json
-from typing import Any, Dict, List, Type, Union
 
-import boto3
-from PIL import Image
+import agent_logging
+import aws_clients
+import cold_start
+from action_group import ActionGroupApp
 
-s3 = boto3.client("s3")
+logger = agent_logging.get_logger(__name__)
 
-bedrock_runtime = boto3.client(
-    service_name="bedrock-runtime",
-    region_name="us-west-2",
-)
+s3 = aws_clients.get_client("s3")
+bedrock_runtime = aws_clients.get_client("bedrock-runtime", "us-west-2")
+
+# Leading bytes of the image formats the model accepts as they are
+MEDIA_TYPE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+]
+
+
+def sniff_media_type(data):
+    """Return the media type of image bytes the model accepts, or None."""
+    for signature, media_type in MEDIA_TYPE_SIGNATURES:
+        if data.startswith(signature):
+            return media_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+@cold_start.at_init
+def load_pil():
+    # PIL is only needed to convert formats the model does not accept
+    return cold_start.lazy_import("PIL.Image")
 
 
 # function to convert a PIL image to a base64 string
@@ -21,7 +43,16 @@ def pil_to_base64(image, format="png"):
         return base64.b64encode(buffer.getvalue()).decode()
 
 
-def gen_image_caption(base64_string):
+def image_to_base64(data):
+    """Return the image as base64 and its media type, converting it to PNG only if needed."""
+    media_type = sniff_media_type(data)
+    if media_type is not None:
+        return base64.b64encode(data).decode(), media_type
+    image = load_pil().open(io.BytesIO(data))
+    return pil_to_base64(image), "image/png"
+
+
+def gen_image_caption(base64_string, media_type="image/png"):
 
     system_prompt = """
 
@@ -40,7 +71,7 @@ def gen_image_caption(base64_string):
                         "type": "image",
                         "source": {
                             "type": "base64",
-                            "media_type": "image/png",
+                            "media_type": media_type,
                             "data": base64_string,
                         },
                     },
@@ -68,50 +99,22 @@ def gen_image_caption(base64_string):
     return results
 
 
-def lambda_handler(event, context):
-    # Print the received event to the logs
-    print("Received event: ")
-    print(event)
-
-    # Initialize response code to None
+app = ActionGroupApp()
 
-    # Extract the action group, api path, and parameters from the prediction
-    actionGroup = event["actionGroup"]
-    function = event.get("function", "")
-    parameters = event.get("parameters", [])
-    inputText = event.get("inputText", "")
-
-    image_url = parameters[0]["value"]
 
+@app.function("describe_image", cache_ttl=300, default=True)
+def describe_image(image_url: str):
+    """Describe the AWS architecture diagram at an S3 URL."""
     # Download image from s3
-
     bucket_name = image_url.split("/")[2].split(".")[0]
     key = "/".join(image_url.split("/")[3:])
     response = s3.get_object(Bucket=bucket_name, Key=key)
     image_content = response["Body"].read()
-    # Create a PIL Image object from the image content
-    image = Image.open(io.BytesIO(image_content))
-    # Convert the PIL Image object to a base64 string
-    base64_string = pil_to_base64(image)
-
-    results = gen_image_caption(base64_string)
-
-    response_body = {"TEXT": {"body": str(results)}}
+    # Sent as downloaded when the model accepts the format, skipping a decode
+    # and re-encode
+    base64_string, media_type = image_to_base64(image_content)
 
-    # Print the response body to the logs
-    print(f"Response body: {response_body}")
+    return gen_image_caption(base64_string, media_type)
 
-    # Create a dictionary containing the response details
-    action_response = {
-        "actionGroup": actionGroup,
-        "function": function,
-        "functionResponse": {"responseBody": response_body},
-    }
-
-    # Return the list of responses as a dictionary
-    api_response = {
-        "messageVersion": event["messageVersion"],
-        "response": action_response,
-    }
 
-    return api_response
+lambda_handler = app
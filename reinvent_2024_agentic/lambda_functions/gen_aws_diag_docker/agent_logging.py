@@ -0,0 +1,174 @@
+"""
+Shared logging setup for the chatbot and the Lambda tools.
+
+Configured with environment variables:
+    LOG_LEVEL           Root log level (default INFO, or AWS_LAMBDA_LOG_LEVEL in Lambda)
+    LOG_FORMAT          "json" for one JSON object per line, "text" otherwise
+    LOG_MAX_PAYLOAD     Characters kept from a logged payload (default 1000)
+    LOG_EVENT_SAMPLE    Per event type sample rates, e.g. "trace=0.1,chunk=1"
+    LOG_DEBUG_SESSIONS  Comma separated session ids whose events are always
+                        dumped in full, whatever the log level
+
+Copies of this module are kept identical by sync_shared_modules.py at the
+repository root: edit the first copy it lists, then run it.
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import random
+
+MAX_PAYLOAD = int(os.getenv("LOG_MAX_PAYLOAD", "1000"))
+DEBUG_SESSIONS = frozenset(
+    s.strip() for s in os.getenv("LOG_DEBUG_SESSIONS", "").split(",") if s.strip()
+)
+
+_session_id = contextvars.ContextVar("session_id", default=None)
+_configured = False
+
+
+def _parse_sample_rates(value):
+    rates = {}
+    for item in value.split(","):
+        if "=" in item:
+            event_type, rate = item.split("=", 1)
+            rates[event_type.strip()] = float(rate)
+    return rates
+
+
+SAMPLE_RATES = _parse_sample_rates(os.getenv("LOG_EVENT_SAMPLE", ""))
+
+
+def _summarize(value, limit):
+    # Raw bytes (file outputs, chunk payloads) are never worth printing
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, dict):
+        return {k: _summarize(v, limit) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if limit is not None and len(value) > 10:
+            return [_summarize(v, limit) for v in value[:10]] + [
+                f"<{len(value) - 10} more>"
+            ]
+        return [_summarize(v, limit) for v in value]
+    if limit is not None and isinstance(value, str) and len(value) > limit:
+        return value[:limit] + f"...<{len(value) - limit} more chars>"
+    return value
+
+
+class Truncated:
+    """
+    Wraps a payload for logging. Nothing is formatted unless the record is
+    actually emitted, and bytes, long strings and long lists are shortened.
+    """
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit=MAX_PAYLOAD):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = str(_summarize(self.value, self.limit))
+        if self.limit is not None and len(text) > self.limit:
+            text = text[: self.limit] + "..."
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single JSON object."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("session_id", "event_type"):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SessionFilter(logging.Filter):
+    """Adds the current session id to every record."""
+
+    def filter(self, record):
+        record.session_id = _session_id.get()
+        return True
+
+
+def configure_logging():
+    """Configure the root logger once. Existing handlers (e.g. Lambda's) are reused."""
+    global _configured
+    if _configured:
+        return
+    _configured = True
+
+    root = logging.getLogger()
+    level = os.getenv("LOG_LEVEL") or os.getenv("AWS_LAMBDA_LOG_LEVEL") or "INFO"
+    root.setLevel(level.upper())
+
+    if not root.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        )
+        root.addHandler(handler)
+
+    for handler in root.handlers:
+        handler.addFilter(SessionFilter())
+        if os.getenv("LOG_FORMAT", "").lower() == "json":
+            handler.setFormatter(JsonFormatter())
+
+
+def get_logger(name):
+    configure_logging()
+    return logging.getLogger(name)
+
+
+def set_session_id(session_id):
+    """Tag subsequent log records in this context with a session id."""
+    return _session_id.set(session_id)
+
+
+@contextlib.contextmanager
+def session_context(session_id):
+    token = _session_id.set(session_id)
+    try:
+        yield
+    finally:
+        _session_id.reset(token)
+
+
+def log_event(logger, event_type, event, index=None):
+    """
+    Dump a raw event at DEBUG, sampled per event type (LOG_EVENT_SAMPLE). Events
+    of sessions listed in LOG_DEBUG_SESSIONS are logged in full at INFO instead.
+    At INFO with no debug sessions this returns after a single level check.
+    """
+    session_id = _session_id.get()
+    if session_id is not None and session_id in DEBUG_SESSIONS:
+        level, payload = logging.INFO, Truncated(event, limit=None)
+    elif logger.isEnabledFor(logging.DEBUG):
+        rate = SAMPLE_RATES.get(event_type, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            return
+        level, payload = logging.DEBUG, Truncated(event)
+    else:
+        return
+
+    logger.log(
+        level,
+        "%s event %s: %s",
+        event_type,
+        index,
+        payload,
+        extra={"event_type": event_type},
+    )
@@ -1,7 +1,6 @@
-import base64
+import functools
 import io
 import json
-import logging
 import os
 import re
 import subprocess
@@ -9,18 +8,19 @@ import sys
 import time
 import uuid
 from datetime import datetime
-from typing import Any, Dict, List, Type, Union
+from typing import Any, Dict
 
-import boto3
-from PIL import Image
+import agent_logging
+import aws_clients
+import cold_start
+from action_group import ActionGroupApp, ActionGroupError
 
-s3 = boto3.client("s3")
+logger = agent_logging.get_logger(__name__)
 
+bedrock_runtime = aws_clients.get_client("bedrock-runtime", "us-west-2")
 
-bedrock_runtime = boto3.client(
-    service_name="bedrock-runtime",
-    region_name="us-west-2",
-)
+# Absolute, since the handler changes the working directory to /tmp
+DIAG_MAPPING_PATH = os.path.join(os.path.dirname(__file__), "diag_mapping.json")
 
 
 def retry_with_backoff(func, *args, max_retries=3, initial_delay=1):
@@ -40,13 +40,13 @@ def retry_with_backoff(func, *args, max_retries=3, initial_delay=1):
                 return result
 
             # If we get here, some part of the result was None
-            print(f"Attempt {attempt + 1} failed with None result")
+            logger.warning("Attempt %d failed with None result", attempt + 1)
         except Exception as e:
-            print(f"Attempt {attempt + 1} failed with error: {str(e)}")
+            logger.warning("Attempt %d failed with error: %s", attempt + 1, e)
 
         if attempt < max_retries - 1:  # Don't sleep on the last attempt
             sleep_time = initial_delay * (2**attempt)  # Exponential backoff
-            print(f"Waiting {sleep_time} seconds before retry...")
+            logger.info("Waiting %s seconds before retry...", sleep_time)
             time.sleep(sleep_time)
 
     return None, None  # Return None if all retries failed
@@ -57,7 +57,7 @@ def upload_to_s3(file_bytes, file_name):
     Upload a file to S3 and return the URL
     """
     try:
-        s3_client = boto3.client("s3")
+        s3_client = aws_clients.get_client("s3")
         bucket_name = os.getenv("S3_BUCKET_NAME")
         # Generate a unique file name to avoid collisions
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -83,7 +83,7 @@ def upload_to_s3(file_bytes, file_name):
         url = f"https://{bucket_name}.s3.amazonaws.com/{s3_key}"
         return url
     except Exception as e:
-        print(f"Error uploading to S3: {str(e)}")
+        logger.error("Error uploading to S3: %s", e)
         return None
 
 
@@ -147,11 +147,15 @@ def load_json(path_to_json: str) -> Dict[str, Any]:
             return conf
 
     except Exception as error:
-        logging.error(error)
+        logger.error(error)
         raise TypeError("Invalid JSON file")
 
 
-aws_service_to_module_mapping = load_json("diag_mapping.json")
+@cold_start.at_init
+@functools.lru_cache(maxsize=1)
+def diag_mapping():
+    """Mapping of AWS service class names to diagrams.aws modules, loaded once."""
+    return load_json(DIAG_MAPPING_PATH)
 
 
 # helper functions
@@ -169,9 +173,9 @@ def save_and_run_python_code(code: str, file_name: str = "/tmp/test_diag.py"):
         )
         # go back...
     except subprocess.CalledProcessError as e:
-        print("Error occurred while running the code:")
-        print(e.stdout)
-        print(e.stderr)
+        logger.error(
+            "Error occurred while running the code:\n%s\n%s", e.stdout, e.stderr
+        )
         # Exit program with error Exception
         raise Exception("Error running the Python code.")
 
@@ -243,6 +247,7 @@ def process_code(code):
 
 def correct_imports(code):
     # Detect all AWS services mentioned in the code
+    aws_service_to_module_mapping = diag_mapping()
     detected_services = [
         service for service in aws_service_to_module_mapping if service in code
     ]
@@ -278,25 +283,23 @@ def diagram_tool(query):
     """
 
     code = call_claude_3_fill(system_prompt, query)
-    print("Base code:")
-    print(code)
+    logger.debug("Base code:\n%s", code)
 
     # Clean up hallucinated code
     code, file_name = process_code(code)
     code = code.replace("```python", "").replace("```", "").replace('"""', "")
     code = correct_imports(code)
 
-    print("Cleaned code:")
-    print(code)
+    logger.debug("Cleaned code:\n%s", code)
 
     try:
         # Code to run
         save_and_run_python_code(code)
-        # Open in tmp
-        img = Image.open(f"/tmp/{file_name}")
-        return img, file_name
+        # The PNG written by diagrams is uploaded as is, without decoding it
+        with open(f"/tmp/{file_name}", "rb") as f:
+            return f.read(), file_name
     except Exception as e:
-        print(e)
+        logger.error(e)
         return None, None
 
 
@@ -307,67 +310,22 @@ def remove_first_line(text):
     return "\n".join(lines)
 
 
-def lambda_handler(event, context):
-    # Print the received event to the logs
-    print("Received event: ")
-    print(event)
-
-    # Extract the action group, api path, and parameters from the prediction
-    actionGroup = event["actionGroup"]
-    function = event.get("function", "")
-    parameters = event.get("parameters", [])
-    inputText = event.get("inputText", "")
-
-    # Generate diagram
-    image, file_name = retry_with_backoff(diagram_tool, inputText)
-
-    if image is None or file_name is None:
-        return {
-            "messageVersion": event["messageVersion"],
-            "response": {
-                "actionGroup": actionGroup,
-                "function": function,
-                "functionResponse": {
-                    "responseBody": {"TEXT": {"body": "Error generating diagram"}}
-                },
-            },
-        }
+app = ActionGroupApp()
 
-    # Convert image to bytes and base64
-    img_byte_array = io.BytesIO()
-    image.save(img_byte_array, format=image.format or "PNG")
-    img_byte_array.seek(0)
+
+@app.function("generate_diagram", default=True)
+def generate_diagram(event):
+    """Generate an AWS architecture diagram for the user's request and upload it."""
+    image_bytes, file_name = retry_with_backoff(diagram_tool, event.input_text)
+    if image_bytes is None or file_name is None:
+        raise ActionGroupError("Error generating diagram")
 
     # Upload image to s3
-    image_url = upload_to_s3(img_byte_array, file_name)
+    image_url = upload_to_s3(image_bytes, file_name)
     if image_url is None:
-        return {
-            "messageVersion": event["messageVersion"],
-            "response": {
-                "actionGroup": actionGroup,
-                "function": function,
-                "functionResponse": {
-                    "responseBody": {"TEXT": {"body": "Error uploading to S3"}}
-                },
-            },
-        }
+        raise ActionGroupError("Error uploading to S3")
 
-    results = {"image_url": image_url}
-    response_body = {"TEXT": {"body": str(results)}}
+    return str({"image_url": image_url})
 
-    # Print the response body to the logs
-    print(f"Response body: {response_body}")
-
-    # Create the response
-    action_response = {
-        "actionGroup": actionGroup,
-        "function": function,
-        "functionResponse": {"responseBody": response_body},
-    }
-
-    api_response = {
-        "messageVersion": event["messageVersion"],
-        "response": action_response,
-    }
 
-    return api_response
+lambda_handler = app
@@ -1,16 +1,29 @@
+import functools
 import json
 import os
 
-import boto3
-import requests
+import agent_logging
+import aws_clients
+import cold_start
+from action_group import ActionGroupApp
 
 # Can get an API KEY here: https://jina.ai/reader/
 JINA_KEY = os.getenv("JINA_KEY")
 
-bedrock_runtime = boto3.client(
-    service_name="bedrock-runtime",
-    region_name="us-west-2",
-)
+logger = agent_logging.get_logger(__name__)
+
+bedrock_runtime = aws_clients.get_client("bedrock-runtime", "us-west-2")
+
+# Seconds to wait for the reader service
+READER_TIMEOUT = int(os.getenv("READER_TIMEOUT", "60"))
+
+
+@cold_start.at_init
+@functools.lru_cache(maxsize=None)
+def http_session():
+    """requests session reused by warm invocations, keeping its connection alive."""
+    requests = cold_start.lazy_import("requests")
+    return requests.Session()
 
 
 def process_website(input_text, website_text):
@@ -48,41 +61,18 @@ def process_website(input_text, website_text):
     return results
 
 
-def lambda_handler(event, context):
-    # Print the received event to the logs
-    print("Received event: ")
-    print(event)
+app = ActionGroupApp()
 
-    # Extract the action group, api path, and parameters from the prediction
-    actionGroup = event["actionGroup"]
-    function = event.get("function", "")
-    parameters = event.get("parameters", [])
-    inputText = event.get("inputText", "")
-    website_url = parameters[0]["value"]
 
+@app.function("website_to_text", cache_ttl=300, default=True)
+def website_to_text(website_url: str, event):
+    """Answer the user's request about a website, read through the Jina reader."""
     url = f"https://r.jina.ai/{website_url}"
     headers = {"Authorization": f"Bearer {JINA_KEY}"}
-    response = requests.get(url, headers=headers)
+    response = http_session().get(url, headers=headers, timeout=READER_TIMEOUT)
 
     # process request
-    result = process_website(inputText, response.text)
-
-    response_body = {"TEXT": {"body": result}}
+    return process_website(event.input_text, response.text)
 
-    # Print the response body to the logs
-    print(f"Response body: {response_body}")
-
-    # Create a dictionary containing the response details
-    action_response = {
-        "actionGroup": actionGroup,
-        "function": function,
-        "functionResponse": {"responseBody": response_body},
-    }
-
-    # Return the list of responses as a dictionary
-    api_response = {
-        "messageVersion": event["messageVersion"],
-        "response": action_response,
-    }
 
-    return api_response
+lambda_handler = app
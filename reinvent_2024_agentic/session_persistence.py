@@ -0,0 +1,228 @@
+# Copies of this module are kept identical by sync_shared_modules.py at the
+# repository root: edit the first copy it lists, then run it.
+
+import abc
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+
+import agent_logging
+
+logger = agent_logging.get_logger(__name__)
+
+# Persisted trace texts are cut to this many characters
+TRACE_TEXT_LIMIT = 2000
+
+
+def summarize_message(message):
+    """Return the form of a chat message that is persisted: traces are shortened."""
+    traces = []
+    for trace in message.get("traces") or []:
+        text = trace["text"]
+        if isinstance(text, str) and len(text) > TRACE_TEXT_LIMIT:
+            text = text[:TRACE_TEXT_LIMIT] + "..."
+        traces.append(dict(trace, text=text))
+    return dict(message, traces=traces)
+
+
+class SessionBackend(abc.ABC):
+    """
+    Interface for session persistence. Messages are stored per session with
+    their absolute position in the conversation, so saving is idempotent.
+    A Redis or DynamoDB backend implements the same methods, e.g. with a
+    hash or a (session_id, position) key schema. A backend missing one of
+    them cannot be instantiated.
+    """
+
+    @abc.abstractmethod
+    def save_messages(self, session_id, positioned_messages):
+        """Store [(position, message dict), ...] for a session."""
+
+    @abc.abstractmethod
+    def load_messages(self, session_id):
+        """Return the messages of a session, oldest first ([] if unknown)."""
+
+    @abc.abstractmethod
+    def delete_session(self, session_id):
+        """Delete every stored message of a session."""
+
+    @abc.abstractmethod
+    def session_exists(self, session_id):
+        """Whether any message of the session is stored."""
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Sessions in a SQLite database, e.g. on a volume shared by the replicas."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " session_id TEXT NOT NULL,"
+                " position INTEGER NOT NULL,"
+                " data TEXT NOT NULL,"
+                " PRIMARY KEY (session_id, position))"
+            )
+
+    def save_messages(self, session_id, positioned_messages):
+        rows = [
+            (session_id, position, json.dumps(message, default=str))
+            for position, message in positioned_messages
+        ]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?)", rows
+            )
+
+    def load_messages(self, session_id):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT data FROM messages WHERE session_id = ? ORDER BY position",
+                (session_id,),
+            ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def delete_session(self, session_id):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM messages WHERE session_id = ?", (session_id,)
+            )
+
+    def session_exists(self, session_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM messages WHERE session_id = ? LIMIT 1", (session_id,)
+            ).fetchone()
+        return row is not None
+
+
+class FileSessionBackend(SessionBackend):
+    """One JSON lines file per session in a local (or shared) folder."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, session_id):
+        path = os.path.realpath(os.path.join(self.folder, f"{session_id}.jsonl"))
+        # Session ids come from the URL, they must not point outside the folder
+        if os.path.dirname(path) != os.path.realpath(self.folder):
+            raise ValueError(f"Invalid session id {session_id!r}")
+        return path
+
+    def save_messages(self, session_id, positioned_messages):
+        with self._lock, open(self._path(session_id), "a") as f:
+            for position, message in positioned_messages:
+                f.write(json.dumps({"position": position, "message": message}) + "\n")
+
+    def load_messages(self, session_id):
+        path = self._path(session_id)
+        if not os.path.exists(path):
+            return []
+        # Later lines win, so re-saving a position replaces it
+        by_position = {}
+        with self._lock, open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    by_position[entry["position"]] = entry["message"]
+        return [by_position[position] for position in sorted(by_position)]
+
+    def delete_session(self, session_id):
+        with self._lock:
+            if os.path.exists(self._path(session_id)):
+                os.remove(self._path(session_id))
+
+    def session_exists(self, session_id):
+        return os.path.exists(self._path(session_id))
+
+
+class WriteBehindWriter:
+    """
+    Batches message writes on a background thread so the chat never waits on the
+    backend. Writes are flushed every flush_interval seconds, or sooner once
+    max_batch messages are queued, and on interpreter exit.
+    """
+
+    def __init__(self, backend, flush_interval=1.0, max_batch=100):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._flushed = threading.Condition()
+        self._pending = 0
+        self._thread = threading.Thread(
+            target=self._run, name="session-writer", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def enqueue(self, session_id, position, message):
+        with self._flushed:
+            self._pending += 1
+        self._queue.put((session_id, position, summarize_message(message)))
+
+    def flush(self, timeout=5.0):
+        """Wait until everything queued so far has been written."""
+        with self._flushed:
+            self._flushed.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.max_batch:
+                    batch.append(self._queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                pass
+            self._write(batch)
+
+    def _write(self, batch):
+        by_session = {}
+        for session_id, position, message in batch:
+            by_session.setdefault(session_id, []).append((position, message))
+        for session_id, positioned_messages in by_session.items():
+            try:
+                self.backend.save_messages(session_id, positioned_messages)
+            except Exception as e:
+                logger.error("Error saving session %s: %s", session_id, e)
+        with self._flushed:
+            self._pending -= len(batch)
+            self._flushed.notify_all()
+
+
+def backend_from_env():
+    """
+    Build the backend named by SESSION_BACKEND: "sqlite:<path>" or "file:<folder>".
+    Returns None when sessions are not persisted.
+    """
+    setting = os.getenv("SESSION_BACKEND", "")
+    kind, _, location = setting.partition(":")
+    if kind == "sqlite":
+        return SQLiteSessionBackend(location or "sessions.db")
+    if kind == "file":
+        return FileSessionBackend(location or "sessions")
+    return None
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """The process-wide writer for the configured backend, or None."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            backend = backend_from_env()
+            if backend is not None:
+                _writer = WriteBehindWriter(backend)
+        return _writer
@@ -0,0 +1,195 @@
+# Copies of this module are kept identical by sync_shared_modules.py at the
+# repository root: edit the first copy it lists, then run it.
+
+import io
+import json
+import os
+import sys
+
+# Rough fixed cost of a stored message and a trace, on top of their text
+MESSAGE_OVERHEAD = 200
+TRACE_OVERHEAD = 100
+
+# Stored in place of a trace text that repeats the message text
+SAME_AS_MESSAGE = object()
+
+
+def _compact_references(references):
+    # Keep only what the UI shows from knowledgeBaseLookupOutput references
+    return tuple(
+        (
+            reference["location"]["s3Location"]["uri"],
+            reference["content"]["text"],
+        )
+        for reference in references
+    )
+
+
+def _expand_references(references):
+    return [
+        {"location": {"s3Location": {"uri": uri}}, "content": {"text": text}}
+        for uri, text in references
+    ]
+
+
+class StoredMessage:
+    """Compact form of a chat message. Traces are (type, text, is_error) tuples."""
+
+    __slots__ = ("role", "text", "images", "traces", "size")
+
+    def __init__(self, role, text, images, traces, size):
+        self.role = role
+        self.text = text
+        self.images = images
+        self.traces = traces
+        self.size = size
+
+    def to_dict(self):
+        traces = []
+        for trace_type, text, is_error in self.traces:
+            if text is SAME_AS_MESSAGE:
+                text = self.text
+            elif trace_type == "knowledgeBaseLookupOutput":
+                text = _expand_references(text)
+            trace = {"trace_type": trace_type, "text": text}
+            if is_error:
+                trace["is_error"] = True
+            traces.append(trace)
+
+        return {
+            "role": self.role,
+            "content": [{"text": self.text}],
+            "images": list(self.images),
+            "traces": traces,
+        }
+
+
+class SessionStore:
+    """
+    Bounded store for one session's chat messages. Messages are kept compactly:
+    trace types are interned, a trace repeating the answer text (finalResponse)
+    points at it instead of holding a copy, knowledge base references keep only
+    their uri and text, and images are kept as artifact keys or URLs rather
+    than decoded PIL images.
+
+    When the estimated size passes byte_budget the oldest messages are evicted.
+    If spill_path is set they are appended to that JSON lines file instead of
+    being dropped, and load_spilled() reads them back.
+
+    With a writer (see session_persistence) every appended message is also
+    queued for the persistence backend under session_id, so the session can be
+    resumed later with restore().
+    """
+
+    def __init__(
+        self,
+        byte_budget=2 * 2**20,
+        spill_path=None,
+        artifact_store=None,
+        session_id=None,
+        writer=None,
+    ):
+        self.byte_budget = byte_budget
+        self.spill_path = spill_path
+        self.artifact_store = artifact_store
+        self.session_id = session_id
+        self.writer = writer
+        self.size = 0
+        self.evicted = 0
+        self._messages = []
+        # messages() result, rebuilt only after the stored messages change
+        self._materialized = None
+
+    def __len__(self):
+        return len(self._messages)
+
+    def _image_ref(self, image):
+        # Decoded images (e.g. PIL) are stored once in the artifact store
+        if not isinstance(image, str) and hasattr(image, "save"):
+            if self.artifact_store is None:
+                return None
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            return self.artifact_store.put(buffer.getvalue(), "image/png")
+        return image
+
+    def append(self, message):
+        """Add a message in the chat history dict format."""
+        stored = self._add(message)
+        if self.writer is not None and self.session_id is not None:
+            position = self.evicted + len(self._messages) - 1
+            self.writer.enqueue(self.session_id, position, stored.to_dict())
+
+    def restore(self, messages):
+        """Load previously persisted messages without persisting them again."""
+        for message in messages:
+            self._add(message)
+
+    def _add(self, message):
+        text = message["content"][0]["text"]
+        size = MESSAGE_OVERHEAD + len(text)
+
+        images = []
+        for image in message.get("images") or []:
+            ref = self._image_ref(image)
+            if ref:
+                images.append(ref)
+                size += len(ref)
+
+        traces = []
+        for trace in message.get("traces") or []:
+            trace_type = sys.intern(trace["trace_type"])
+            trace_text = trace["text"]
+            if trace_text == text and text:
+                trace_text = SAME_AS_MESSAGE
+                size += TRACE_OVERHEAD
+            elif trace_type == "knowledgeBaseLookupOutput":
+                trace_text = _compact_references(trace_text)
+                size += TRACE_OVERHEAD + sum(len(u) + len(t) for u, t in trace_text)
+            else:
+                size += TRACE_OVERHEAD + len(str(trace_text))
+            traces.append((trace_type, trace_text, bool(trace.get("is_error"))))
+
+        stored = StoredMessage(
+            sys.intern(message["role"]), text, tuple(images), tuple(traces), size
+        )
+        self._messages.append(stored)
+        self._materialized = None
+        self.size += size
+        self._enforce_budget()
+        return stored
+
+    def _enforce_budget(self):
+        # Always keep the newest message, even if it alone is over budget
+        evicted = []
+        while self.size > self.byte_budget and len(self._messages) > 1:
+            stored = self._messages.pop(0)
+            self.size -= stored.size
+            evicted.append(stored)
+
+        if not evicted:
+            return
+        self.evicted += len(evicted)
+
+        if self.spill_path:
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            with open(self.spill_path, "a") as f:
+                for stored in evicted:
+                    f.write(json.dumps(stored.to_dict(), default=str) + "\n")
+
+    def messages(self):
+        """
+        Return the stored messages in the chat history dict format. The list is
+        built once and shared until the next append or restore, so Streamlit
+        reruns don't rebuild it; callers must not modify it.
+        """
+        if self._materialized is None:
+            self._materialized = [stored.to_dict() for stored in self._messages]
+        return self._materialized
+
+    def load_spilled(self):
+        """Return the messages evicted to the spill file, oldest first."""
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return []
+        with open(self.spill_path, "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
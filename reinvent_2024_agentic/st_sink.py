@@ -0,0 +1,120 @@
+# Copies of this module are kept identical by sync_shared_modules.py at the
+# repository root: edit the first copy it lists, then run it.
+
+import time
+
+import streamlit as st
+from trace_parser import TextDelta, TraceRecord
+
+# Minimum seconds between Streamlit writes while a turn is streaming
+FRAME_INTERVAL = 0.05
+
+
+def _render_code(record):
+    st.code(record.text)
+
+
+def _render_markdown(record):
+    st.markdown(record.text)
+
+
+def _render_action_group_invocation(record):
+    st.markdown(f"Calling function: {record.text}")
+
+
+def _render_references(record):
+    for reference in record.text:
+        st.markdown(f'{reference["location"]["s3Location"]["uri"]}')
+        st.markdown(f'{reference["content"]["text"]}')
+
+
+# How each trace type is shown inside its expander, markdown by default
+TRACE_RENDERERS = {
+    "codeInterpreter": _render_code,
+    "actionGroupInvocation": _render_action_group_invocation,
+    "knowledgeBaseLookupOutput": _render_references,
+}
+
+
+def render_trace(record, trace_container):
+    """Render a TraceRecord in the trace container."""
+    if record.trace_type == "guardrail":
+        trace_container.error(record.text)
+        return
+
+    with trace_container.expander(record.trace_type):
+        if record.is_error:
+            st.error(record.text)
+        else:
+            TRACE_RENDERERS.get(record.trace_type, _render_markdown)(record)
+
+
+class StreamlitSink:
+    """
+    Renders parsed agent records in Streamlit. Records are buffered and written at
+    most once per frame, so a burst of trace events costs one round of delta writes
+    instead of one per event.
+    """
+
+    def __init__(
+        self, trace_container, text_placeholder=None, frame_interval=FRAME_INTERVAL
+    ):
+        self.trace_container = trace_container
+        self.text_placeholder = text_placeholder
+        self.frame_interval = frame_interval
+        self._text = ""
+        self._text_changed = False
+        self._pending_traces = []
+        self._last_flush = 0.0
+
+    def handle(self, record):
+        if isinstance(record, TraceRecord):
+            self._pending_traces.append(record)
+        elif isinstance(record, TextDelta):
+            self._text += record.text
+            self._text_changed = True
+        else:
+            return
+
+        if time.monotonic() - self._last_flush >= self.frame_interval:
+            self.flush()
+
+    def flush(self, final=False):
+        for record in self._pending_traces:
+            render_trace(record, self.trace_container)
+        self._pending_traces.clear()
+
+        if self.text_placeholder is not None and (self._text_changed or final):
+            # Show a cursor while the answer is still streaming
+            self.text_placeholder.markdown(self._text if final else self._text + "▌")
+            self._text_changed = False
+
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush(final=True)
+
+
+def render_waterfall(timer, container, width=24):
+    """Show the latency breakdown of a turn (a finished TurnTimer) as a text waterfall."""
+    total = timer.total or 0.0
+    scale = width / total if total else 0
+    lines = []
+    for span in timer.spans:
+        offset = int(span.start * scale)
+        bar = "█" * max(int(span.duration * scale), 1)
+        lines.append(
+            f"{span.name[:20]:<20} {' ' * offset}{bar:<{width - offset}} "
+            f"{span.duration * 1000:7.0f} ms"
+        )
+        if "server_seconds" in span.attributes:
+            lines.append(
+                f"{'  on the service':<20} {'':<{width}} "
+                f"{span.attributes['server_seconds'] * 1000:7.0f} ms"
+            )
+    for name, (seconds, calls) in timer.local.items():
+        lines.append(f"{'local ' + name:<20} {'':<{width}} {seconds * 1000:7.0f} ms")
+
+    with container:
+        st.caption(f"Last turn: {total:.2f} s")
+        st.code("\n".join(lines), language=None)
@@ -0,0 +1,282 @@
+# Copies of this module are kept identical by sync_shared_modules.py at the
+# repository root: edit the first copy it lists, then run it.
+
+import codecs
+import inspect
+import json
+
+import agent_logging
+
+logger = agent_logging.get_logger(__name__)
+
+
+class TextDelta:
+    """A piece of the agent's answer text, in stream order."""
+
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return f"TextDelta({self.text!r})"
+
+
+class TraceRecord:
+    """One parsed trace, e.g. a rationale, a code interpreter call or an observation."""
+
+    __slots__ = ("trace_type", "text", "is_error", "image_url", "event_time")
+
+    def __init__(self, trace_type, text, is_error=False, image_url=None):
+        self.trace_type = trace_type
+        self.text = text
+        self.is_error = is_error
+        self.image_url = image_url
+        # Service timestamp of the trace event (eventTime), set by parse_trace
+        self.event_time = None
+
+    def __repr__(self):
+        return f"TraceRecord({self.trace_type!r}, {self.text!r})"
+
+    def to_dict(self):
+        """Plain dict form kept in the chat history."""
+        trace_object = {"trace_type": self.trace_type, "text": self.text}
+        if self.is_error:
+            trace_object["is_error"] = True
+        if self.image_url:
+            trace_object["image_url"] = self.image_url
+        return trace_object
+
+
+class FileOutput:
+    """A file emitted by the agent, e.g. a chart from the code interpreter."""
+
+    __slots__ = ("name", "type", "data")
+
+    def __init__(self, name, type, data):
+        self.name = name
+        self.type = type
+        self.data = data
+
+    def __repr__(self):
+        return f"FileOutput({self.name!r}, {self.type!r}, {len(self.data)} bytes)"
+
+
+# Handlers keyed on (trace family, sub-type), e.g. ("orchestrationTrace", "rationale")
+TRACE_HANDLERS = {}
+
+# Trace parts that wrap the concrete sub-type one level down, e.g.
+# observation -> codeInterpreterInvocationOutput. Their inner keys are dispatched.
+NESTED_PARTS = frozenset(["invocationInput", "observation"])
+
+
+def register_trace_handler(family, sub_type):
+    """
+    Register a handler for a trace family and sub-type. The handler receives the
+    sub-type payload and yields TraceRecords.
+    Registering the same key again replaces the existing handler.
+    """
+
+    def decorator(func):
+        TRACE_HANDLERS[(family, sub_type)] = func
+        return func
+
+    return decorator
+
+
+def parse_trace(trace):
+    """
+    Return the TraceRecords for one trace event (event["trace"]). Every part of
+    the event is looked up once in TRACE_HANDLERS; unknown parts are ignored.
+    """
+    records = []
+    for family, body in trace.get("trace", {}).items():
+        if not isinstance(body, dict):
+            continue
+        for part, value in body.items():
+            if part in NESTED_PARTS and isinstance(value, dict):
+                items = value.items()
+            else:
+                items = ((part, value),)
+            for sub_type, payload in items:
+                handler = TRACE_HANDLERS.get((family, sub_type))
+                if handler is not None:
+                    records.extend(handler(payload))
+
+    event_time = trace.get("eventTime")
+    if event_time is not None:
+        for record in records:
+            record.event_time = event_time
+    return records
+
+
+# Orchestration traces
+@register_trace_handler("orchestrationTrace", "rationale")
+def rationale(payload):
+    yield TraceRecord("rationale", payload["text"])
+
+
+@register_trace_handler("orchestrationTrace", "codeInterpreterInvocationInput")
+def code_interpreter_input(payload):
+    yield TraceRecord("codeInterpreter", payload["code"])
+
+
+@register_trace_handler("orchestrationTrace", "knowledgeBaseLookupInput")
+def knowledge_base_lookup_input(payload):
+    yield TraceRecord("knowledgeBaseLookup", payload["text"])
+
+
+@register_trace_handler("orchestrationTrace", "actionGroupInvocationInput")
+def action_group_invocation_input(payload):
+    yield TraceRecord("actionGroupInvocation", payload["function"])
+
+
+@register_trace_handler("orchestrationTrace", "codeInterpreterInvocationOutput")
+def code_interpreter_output(payload):
+    if "executionOutput" in payload:
+        yield TraceRecord("observation", payload["executionOutput"])
+    if "executionError" in payload:
+        yield TraceRecord("observation", payload["executionError"], is_error=True)
+
+
+@register_trace_handler("orchestrationTrace", "knowledgeBaseLookupOutput")
+def knowledge_base_lookup_output(payload):
+    yield TraceRecord(
+        "knowledgeBaseLookupOutput", payload.get("retrievedReferences", [])
+    )
+
+
+@register_trace_handler("orchestrationTrace", "actionGroupInvocationOutput")
+def action_group_invocation_output(payload):
+    yield TraceRecord("observation", payload["text"])
+
+
+@register_trace_handler("orchestrationTrace", "finalResponse")
+def final_response(payload):
+    yield TraceRecord("finalResponse", payload["text"])
+
+
+# Pre/post processing and failure traces
+@register_trace_handler("preProcessingTrace", "modelInvocationOutput")
+def pre_processing_output(payload):
+    parsed = payload.get("parsedResponse", {})
+    if "rationale" in parsed:
+        yield TraceRecord("preProcessing", parsed["rationale"])
+
+
+@register_trace_handler("postProcessingTrace", "modelInvocationOutput")
+def post_processing_output(payload):
+    parsed = payload.get("parsedResponse", {})
+    if "text" in parsed:
+        yield TraceRecord("postProcessing", parsed["text"])
+
+
+@register_trace_handler("failureTrace", "failureReason")
+def failure_reason(payload):
+    yield TraceRecord("failure", payload, is_error=True)
+
+
+# Guardrail traces
+def _guardrail_assessments(assessments):
+    for assessment in assessments:
+        for filter in assessment.get("contentPolicy", {}).get("filters", []):
+            if filter["action"] == "BLOCKED":
+                yield TraceRecord(
+                    "guardrail",
+                    f"Guardrail blocked {filter['type']} confidence: {filter['confidence']}",
+                    is_error=True,
+                )
+        for topic in assessment.get("topicPolicy", {}).get("topics", []):
+            if topic["action"] == "BLOCKED":
+                yield TraceRecord(
+                    "guardrail",
+                    f"Guardrail blocked topic {topic['name']}",
+                    is_error=True,
+                )
+
+
+register_trace_handler("guardrailTrace", "inputAssessments")(_guardrail_assessments)
+register_trace_handler("guardrailTrace", "outputAssessments")(_guardrail_assessments)
+
+
+def parse_json_text(text):
+    """Best effort parse of an action group response body, which may use single quotes."""
+    try:
+        return json.loads(text.replace("'", '"'))
+    except (AttributeError, ValueError):
+        return None
+
+
+def parse_event(event, index, decoder):
+    """
+    Yield the records for one raw completion event. decoder is an incremental
+    UTF-8 decoder shared across the stream, since chunks can split a character.
+    """
+    # Events are dicts with a single key naming their type, e.g. "trace"
+    agent_logging.log_event(logger, next(iter(event), "unknown"), event, index)
+
+    if "trace" in event:
+        # A trace the handlers do not expect is logged and skipped, it must not
+        # end the turn and lose the answer that follows
+        try:
+            records = parse_trace(event["trace"])
+        except Exception as e:
+            logger.warning("Skipping malformed trace event %s: %r", index, e)
+            agent_logging.log_event(logger, "malformedTrace", event, index)
+        else:
+            yield from records
+
+    if "chunk" in event and "bytes" in event["chunk"]:
+        text = decoder.decode(event["chunk"]["bytes"])
+        if text:
+            yield TextDelta(text)
+
+    if "files" in event:
+        for file in event["files"]["files"]:
+            yield FileOutput(file["name"], file["type"], file["bytes"])
+
+
+def _flush_decoder(decoder):
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield TextDelta(text)
+
+
+def parse_agent_events(event_stream):
+    """
+    Yield TextDelta, TraceRecord and FileOutput records from an agent completion
+    event stream as they arrive. This has no UI dependency, so it can run in a
+    worker thread or a CLI. The stream is always drained or closed, so the HTTP
+    connection is released even if the caller stops early.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        for index, event in enumerate(event_stream):
+            yield from parse_event(event, index, decoder)
+        yield from _flush_decoder(decoder)
+    finally:
+        close = getattr(event_stream, "close", None)
+        if close is not None:
+            close()
+
+
+async def aparse_agent_events(event_stream):
+    """Async counterpart of parse_agent_events, for streams iterated with async for."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    index = 0
+    try:
+        async for event in event_stream:
+            for record in parse_event(event, index, decoder):
+                yield record
+            index += 1
+        for record in _flush_decoder(decoder):
+            yield record
+    finally:
+        # Async generators are closed with aclose(), aioboto3 streams with close()
+        close = getattr(event_stream, "aclose", None) or getattr(
+            event_stream, "close", None
+        )
+        if close is not None:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
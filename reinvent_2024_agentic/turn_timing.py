@@ -0,0 +1,183 @@
+# Copies of this module are kept identical by sync_shared_modules.py at the
+# repository root: edit the first copy it lists, then run it.
+
+import contextlib
+import datetime
+import time
+
+from trace_parser import TextDelta, TraceRecord
+
+# Trace types that start a tool call, and the span name used for the call
+TOOL_INPUTS = {
+    "codeInterpreter": "code interpreter",
+    "knowledgeBaseLookup": "knowledge base",
+    "actionGroupInvocation": "action group",
+}
+
+# Trace types that carry a tool's result and end its span
+TOOL_OUTPUTS = frozenset(["observation", "knowledgeBaseLookupOutput"])
+
+
+def _event_seconds(event_time):
+    # eventTime is a datetime from botocore, or an ISO string in recorded streams
+    if isinstance(event_time, str):
+        event_time = datetime.datetime.fromisoformat(event_time.replace("Z", "+00:00"))
+    if isinstance(event_time, datetime.datetime):
+        return event_time.timestamp()
+    return None
+
+
+class Span:
+    """A named interval of a turn, in seconds from the start of the turn."""
+
+    __slots__ = ("name", "start", "end", "attributes")
+
+    def __init__(self, name, start, end, attributes=None):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.attributes = attributes or {}
+
+    def __repr__(self):
+        return f"Span({self.name!r}, {self.start:.3f}, {self.end:.3f})"
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class TurnTimer:
+    """
+    Latency breakdown of one agent turn. observe() is called with every parsed
+    record as it arrives and splits the turn into consecutive spans: waiting for
+    the first event, model steps between tool calls, each tool call (code
+    interpreter, knowledge base, action group) and the answer streaming in.
+    Tool spans also record the duration between the input and output traces
+    on the service clock (eventTime) as server_seconds.
+
+    Local work (rendering, saving files) is interleaved with the stream, so it
+    is accumulated per name with measure() rather than kept as spans.
+    """
+
+    def __init__(self, session_id=None):
+        self.session_id = session_id
+        self.wall_start_ns = time.time_ns()
+        self._start = time.monotonic()
+        self.spans = []
+        self.local = {}
+        self.total = None
+        self._first_event = None
+        self._step_start = None
+        self._tool = None
+        self._first_text = None
+        self._last_text = None
+
+    def now(self):
+        return time.monotonic() - self._start
+
+    def observe(self, record):
+        now = self.now()
+        if self._first_event is None:
+            self.spans.append(Span("first event", 0.0, now))
+            self._first_event = self._step_start = now
+
+        if isinstance(record, TextDelta):
+            if self._first_text is None:
+                self._close_step(now, "model (final answer)")
+                self._first_text = now
+            self._last_text = now
+        elif isinstance(record, TraceRecord):
+            if record.trace_type in TOOL_INPUTS:
+                self._close_step(now, "model")
+                self._tool = (
+                    TOOL_INPUTS[record.trace_type],
+                    now,
+                    _event_seconds(getattr(record, "event_time", None)),
+                )
+            elif record.trace_type in TOOL_OUTPUTS and self._tool is not None:
+                name, start, server_start = self._tool
+                attributes = {}
+                server_end = _event_seconds(getattr(record, "event_time", None))
+                if server_start is not None and server_end is not None:
+                    attributes["server_seconds"] = server_end - server_start
+                if record.is_error:
+                    attributes["error"] = True
+                self.spans.append(Span(name, start, now, attributes))
+                self._tool = None
+                self._step_start = now
+
+    def _close_step(self, now, name):
+        if self._step_start is not None and self._tool is None:
+            self.spans.append(Span(name, self._step_start, now))
+            self._step_start = None
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        """Add the time spent in the with block to the local work called name."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            seconds, calls = self.local.get(name, (0.0, 0))
+            self.local[name] = (seconds + time.monotonic() - start, calls + 1)
+
+    def finish(self):
+        """End the turn; returns self so it can be kept in the model response."""
+        now = self.now()
+        if self._tool is not None:
+            name, start, _ = self._tool
+            self.spans.append(Span(name, start, now, {"unfinished": True}))
+            self._tool = None
+        if self._first_text is not None:
+            self.spans.append(
+                Span("answer streaming", self._first_text, self._last_text)
+            )
+        elif self._step_start is not None:
+            self.spans.append(Span("model", self._step_start, now))
+        self.total = now
+        return self
+
+    def to_dict(self):
+        return {
+            "total": self.total,
+            "spans": [
+                dict(name=s.name, start=s.start, end=s.end, **s.attributes)
+                for s in self.spans
+            ],
+            "local": {
+                name: {"seconds": seconds, "calls": calls}
+                for name, (seconds, calls) in self.local.items()
+            },
+        }
+
+
+def export_to_opentelemetry(timer, tracer=None):
+    """
+    Emit the turn as an OpenTelemetry span with one child span per phase. Does
+    nothing (and returns False) when opentelemetry is not installed.
+    """
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return False
+
+    tracer = tracer or trace.get_tracer(__name__)
+    start_ns = timer.wall_start_ns
+    attributes = {
+        f"local.{name}.seconds": seconds for name, (seconds, _) in timer.local.items()
+    }
+    if timer.session_id:
+        attributes["session.id"] = timer.session_id
+
+    root = tracer.start_span("agent turn", start_time=start_ns, attributes=attributes)
+    context = trace.set_span_in_context(root)
+    for span in timer.spans:
+        child = tracer.start_span(
+            span.name,
+            context=context,
+            start_time=start_ns + int(span.start * 1e9),
+            attributes=span.attributes,
+        )
+        child.end(end_time=start_ns + int(span.end * 1e9))
+    root.end(end_time=start_ns + int((timer.total or timer.now()) * 1e9))
+    return True
@@ -0,0 +1,98 @@
+"""
+Keeps the files shared by several folders of this repository identical.
+
+Each folder is deployed on its own (a Streamlit app, the workflow script, a
+Lambda zip, a Docker build context), so a shared module is copied next to the
+code that imports it instead of being imported from one place. Edit the
+first copy listed in SHARED_MODULES, then run
+
+    python sync_shared_modules.py           # copy it over the other copies
+    python sync_shared_modules.py --check   # exit 1 if a copy differs
+"""
+
+import argparse
+import os
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+LAMBDA_FUNCTIONS = os.path.join("reinvent_2024_agentic", "lambda_functions")
+DIAGRAM_DOCKER = os.path.join(LAMBDA_FUNCTIONS, "gen_aws_diag_docker")
+
+# Modules of the two Streamlit chatbots that are the same in both
+CHATBOTS = ["agentic_chatbot", "reinvent_2024_agentic"]
+CHATBOT_MODULES = [
+    "artifacts.py",
+    "benchmark_parser.py",
+    "event_replay.py",
+    "history_view.py",
+    "session_ids.py",
+    "session_persistence.py",
+    "session_store.py",
+    "st_sink.py",
+    "trace_parser.py",
+    "test_trace_parser.py",
+    "turn_timing.py",
+    os.path.join("fixtures", "sample_completion.jsonl"),
+]
+
+# File -> folders holding a copy, the source of the copies first
+SHARED_MODULES = {
+    "agent_logging.py": [
+        "agentic_chatbot",
+        "reinvent_2024_agentic",
+        "lambda_function_tools",
+        LAMBDA_FUNCTIONS,
+        DIAGRAM_DOCKER,
+    ],
+    "aws_clients.py": [
+        "agentic_chatbot",
+        "reinvent_2024_agentic",
+        "agentic_workflow",
+        "lambda_function_tools",
+        LAMBDA_FUNCTIONS,
+        DIAGRAM_DOCKER,
+    ],
+    "action_group.py": ["lambda_function_tools", LAMBDA_FUNCTIONS, DIAGRAM_DOCKER],
+    "converse_stream.py": ["agentic_workflow", LAMBDA_FUNCTIONS],
+    "cold_start.py": [LAMBDA_FUNCTIONS, DIAGRAM_DOCKER],
+    **{module: CHATBOTS for module in CHATBOT_MODULES},
+}
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def stale_copies():
+    """Yield (source, copy) for every copy that differs from its source."""
+    for module, folders in SHARED_MODULES.items():
+        source = os.path.join(ROOT, folders[0], module)
+        data = _read(source)
+        for folder in folders[1:]:
+            copy = os.path.join(ROOT, folder, module)
+            if not os.path.exists(copy) or _read(copy) != data:
+                yield source, copy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--check", action="store_true", help="only report copies that differ"
+    )
+    args = parser.parse_args()
+
+    stale = list(stale_copies())
+    for source, copy in stale:
+        action = "differs from" if args.check else "updated from"
+        print(f"{os.path.relpath(copy, ROOT)} {action} {os.path.relpath(source, ROOT)}")
+        if not args.check:
+            shutil.copyfile(source, copy)
+    if args.check and stale:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()